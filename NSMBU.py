@@ -3,12 +3,17 @@
 
 # hi skawo
 
-from items import ObjectItem, ZoneItem, LocationItem, SpriteItem, EntranceItem
+from items import ObjectItem, ZoneItem, LocationItem, SpriteItem, EntranceItem, PathItem, PathNodeItem
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import instrument
+import io
+from operator import attrgetter
 import os.path
-import SarcLib
+import sarc
 import struct
 
-from tileset import LoadTileset, SaveTileset
+from tileset import LoadTileset, SaveTileset, GetTilesetPath, SetTilesetPath, GetTextureOptions, SetTextureOptions
 
 
 def bytes_to_string(data, offset=0, charWidth=1, encoding='utf-8'):
@@ -30,16 +35,6 @@ def to_bytes(inp, length=1, endianness='big'):
     elif isinstance(inp, str):
         return inp.encode('utf-8').ljust(length, b'\0')
 
-def exists(arc, fn):
-    try:
-        arc[fn]
-
-    except KeyError:
-        return False
-
-    return True
-
-
 def checkContent(data):
     if not data.startswith(b'SARC'):
         return False
@@ -91,11 +86,13 @@ class Metadata:
         self.DataDict = {}
         if data is None: return
 
+        # Entries are kept as views into data, so nothing is copied
+        data = memoryview(data)
+
         if data[0:4] != b'MD2_':
             # This is old-style metadata - convert it
             try:
-                strdata = ''
-                for d in data: strdata += chr(d)
+                strdata = str(data, 'latin-1')
                 level_info = pickle.loads(strdata)
                 for k, v in level_info.iteritems():
                     self.setStrData(k, v)
@@ -105,50 +102,44 @@ class Metadata:
                 self.DataDict['Website'] = self.DataDict['Webpage']
             return
 
+        unpackInt = struct.Struct('>I').unpack_from
+        unpackEntry = struct.Struct('>II').unpack_from
+
         # Iterate through the data
         idx = 4
-        while idx < len(data) - 4:
+        end = len(data) - 4
+        while idx < end:
 
-            # Read the next (first) four bytes - the key length
-            rawKeyLen = data[idx:idx + 4]
+            # Read the key length, then the key (as a str)
+            keyLen, = unpackInt(data, idx)
             idx += 4
 
-            keyLen = (rawKeyLen[0] << 24) | (rawKeyLen[1] << 16) | (rawKeyLen[2] << 8) | rawKeyLen[3]
-
-            # Read the next (key length) bytes - the key (as a str)
-            rawKey = data[idx:idx + keyLen]
+            key = str(data[idx:idx + keyLen], 'latin-1')
             idx += keyLen
 
-            key = ''
-            for b in rawKey: key += chr(b)
-
-            # Read the next four bytes - the number of type entries
-            rawTypeEntries = data[idx:idx + 4]
+            # Read the number of type entries
+            typeEntries, = unpackInt(data, idx)
             idx += 4
 
-            typeEntries = (rawTypeEntries[0] << 24) | (rawTypeEntries[1] << 16) | (rawTypeEntries[2] << 8) | \
-                          rawTypeEntries[3]
+            if key not in self.DataDict: self.DataDict[key] = {}
+            types = self.DataDict[key]
 
             # Iterate through each type entry
             for entry in range(typeEntries):
-                # Read the next four bytes - the type
-                rawType = data[idx:idx + 4]
-                idx += 4
-
-                type = (rawType[0] << 24) | (rawType[1] << 16) | (rawType[2] << 8) | rawType[3]
-
-                # Read the next four bytes - the data length
-                rawDataLen = data[idx:idx + 4]
-                idx += 4
+                # Read the type and the data length, then the data
+                type, dataLen = unpackEntry(data, idx)
+                idx += 8
 
-                dataLen = (rawDataLen[0] << 24) | (rawDataLen[1] << 16) | (rawDataLen[2] << 8) | rawDataLen[3]
-
-                # Read the next (data length) bytes - the data (as bytes)
-                entryData = data[idx:idx + dataLen]
+                types[type] = data[idx:idx + dataLen]
                 idx += dataLen
 
-                # Add it to typeData
-                self.setOtherData(key, type, entryData)
+    def __getstate__(self):
+        # Views into the course data can't be pickled
+        return {key: {type: bytes(data) for type, data in types.items()}
+                for key, types in self.DataDict.items()}
+
+    def __setstate__(self, state):
+        self.DataDict = state
 
     def binData(self, key):
         """
@@ -162,9 +153,7 @@ class Metadata:
         """
         data = self.otherData(key, 1)
         if data is None: return
-        s = ''
-        for d in data: s += chr(d)
-        return s
+        return str(data, 'latin-1')
 
     def otherData(self, key, type):
         """
@@ -184,9 +173,7 @@ class Metadata:
         """
         Sets string data, overwriting any existing string data with that key
         """
-        data = []
-        for char in value: data.append(ord(char))
-        self.setOtherData(key, 1, data)
+        self.setOtherData(key, 1, value.encode('latin-1'))
 
     def setOtherData(self, key, type, value):
         """
@@ -199,65 +186,157 @@ class Metadata:
         """
         Returns a bytes object that can later be loaded from
         """
+        packInt = struct.Struct('>I').pack
+        packEntry = struct.Struct('>II').pack
 
-        # Sort self.DataDict
-        dataDictSorted = []
-        for dataKey in self.DataDict: dataDictSorted.append((dataKey, self.DataDict[dataKey]))
-        dataDictSorted.sort(key=lambda entry: entry[0])
+        data = [b'MD2_']
+        append = data.append
 
-        data = []
+        # Iterate through self.DataDict, sorted by key
+        for dataKey in sorted(self.DataDict):
+            types = self.DataDict[dataKey]
 
-        # Add 'MD2_'
-        data.append(ord('M'))
-        data.append(ord('D'))
-        data.append(ord('2'))
-        data.append(ord('_'))
+            # Add the key length and the key
+            key = dataKey.encode('latin-1')
+            append(packInt(len(key)))
+            append(key)
 
-        # Iterate through self.DataDict
-        for dataKey, types in dataDictSorted:
+            # Add the number of types
+            append(packInt(len(types)))
 
-            # Add the key length (4 bytes)
-            keyLen = len(dataKey)
-            data.append(keyLen >> 24)
-            data.append((keyLen >> 16) & 0xFF)
-            data.append((keyLen >> 8) & 0xFF)
-            data.append(keyLen & 0xFF)
+            # Add the type, the data length and the data, sorted by type
+            for type in sorted(types):
+                typeData = types[type]
+                append(packEntry(type, len(typeData)))
+                append(typeData)
 
-            # Add the key (key length bytes)
-            for char in dataKey: data.append(ord(char))
+        return b''.join(data)
 
-            # Sort the types
-            typesSorted = []
-            for type in types: typesSorted.append((type, types[type]))
-            typesSorted.sort(key=lambda entry: entry[0])
 
-            # Add the number of types (4 bytes)
-            typeNum = len(typesSorted)
-            data.append(typeNum >> 24)
-            data.append((typeNum >> 16) & 0xFF)
-            data.append((typeNum >> 8) & 0xFF)
-            data.append(typeNum & 0xFF)
+def ReadTilesetNames(block, offset=0):
+    """
+    Returns the four tileset names stored in block 1 of a course file
+    """
+    return [bytes_to_string(name) for name in struct.unpack_from('32s32s32s32s', block, offset)]
+
+
+def GetLevelTilesetNames(data):
+    """
+    Returns the tileset names of every area of a level, reading
+    nothing but block 1 of each course file
+    """
+    arc = sarc.Reader(data)
+
+    areas = []
+    thisArea = 1
+    while 'course/course%d.bin' % thisArea in arc:
+        course = arc['course/course%d.bin' % thisArea]
+        offset, size = struct.unpack_from('<II', course, 0)
+        areas.append(ReadTilesetNames(course, offset))
+
+        thisArea += 1
 
-            # Iterate through typesSorted
-            for type, typeData in typesSorted:
+    return areas
 
-                # Add the type (4 bytes)
-                data.append(type >> 24)
-                data.append((type >> 16) & 0xFF)
-                data.append((type >> 8) & 0xFF)
-                data.append(type & 0xFF)
 
-                # Add the data length (4 bytes)
-                dataLen = len(typeData)
-                data.append(dataLen >> 24)
-                data.append((dataLen >> 16) & 0xFF)
-                data.append((dataLen >> 8) & 0xFF)
-                data.append(dataLen & 0xFF)
+def GetTilesetSlots(areas):
+    """
+    Returns the tileset names used by a level's areas (as given by
+    GetLevelTilesetNames()) in the order they're saved, each with the
+    slot it's first used in, which is the slot it's saved from
+    """
+    slots = {}
+    for names in areas:
+        for slot, name in enumerate(names):
+            if name and name not in slots:
+                slots[name] = slot
+
+    return slots
+
+
+def initWorker(tilesetPath, textureOptions):
+    """
+    Sets up a worker process like the main one
+    """
+    SetTilesetPath(tilesetPath)
+    SetTextureOptions(**textureOptions)
 
-                # Add the data (data length bytes)
-                for d in typeData: data.append(d)
 
-        return data
+def makeExecutor(workers):
+    """
+    Returns a process pool for loading and saving areas and tilesets
+    """
+    # Resolve the tileset path here, workers can't ask for it
+    textureOptions = GetTextureOptions()
+
+    # Workers encode their textures themselves, a pool in each of them
+    # would start workers * encodeWorkers processes
+    textureOptions['encodeWorkers'] = 1
+
+    return ProcessPoolExecutor(workers, initializer=initWorker, initargs=(GetTilesetPath(), textureOptions))
+
+
+def loadArea(areanum, course, L0, L1, L2, loadTilesets=True):
+    """
+    Parses a single area (runs in a worker when loading in parallel)
+    """
+    area = Game.Level.Area()
+    area.areanum = areanum
+    with instrument.stage('area.load', len(course)):
+        area.load(course, L0, L1, L2, loadTilesets=loadTilesets)
+
+    return area
+
+
+def saveArea(area):
+    """
+    Saves a single area (runs in a worker when saving in parallel)
+    """
+    with instrument.stage('area.save'):
+        return area.save()
+
+
+def makeCourseArchive(areaData):
+    """
+    Returns the archive of the course files, areaData being
+    the (course, L0, L1, L2) of every area
+    """
+    archive = sarc.Writer()
+    for areanum, (course, L0, L1, L2) in enumerate(areaData):
+        if course is not None:
+            archive.addFile('course/course%d.bin' % (areanum + 1), course)
+        if L0 is not None:
+            archive.addFile('course/course%d_bgdatL0.bin' % (areanum + 1), L0)
+        if L1 is not None:
+            archive.addFile('course/course%d_bgdatL1.bin' % (areanum + 1), L1)
+        if L2 is not None:
+            archive.addFile('course/course%d_bgdatL2.bin' % (areanum + 1), L2)
+
+    return archive
+
+
+def makeLevelArchive(name, course, tilesets):
+    """
+    Returns the archive of a level, course being its course archive
+    and tilesets the (name, saved tileset) of the tilesets it embeds
+    """
+    archive = sarc.Writer()
+    for tileset, data in tilesets:
+        archive.addFile(tileset, data)
+
+    archive.addFile(name, course)
+    return archive
+
+
+def withoutTilesets(area):
+    """
+    Returns a shallow copy of the area that doesn't hold on to its tilesets,
+    so they aren't sent to a worker that doesn't need them
+    """
+    area = copy.copy(area)
+    area.tileset0Obj = area.tileset1Obj = area.tileset2Obj = area.tileset3Obj = None
+
+    return area
 
 
 class Game:
@@ -326,7 +405,7 @@ class Game:
                 bg = struct.unpack('<HHHH16sxBxx', self.blocks[4])
                 self.bgs[bg[0]] = bg
 
-            def load(self, course, L0, L1, L2, progress=None):
+            def load(self, course, L0, L1, L2, progress=None, loadTilesets=True):
                 """
                 Loads an area from the archive files
                 """
@@ -335,7 +414,7 @@ class Game:
                 self.LoadBlocks(course)
 
                 # Load stuff from individual blocks
-                self.LoadTilesetNames()  # block 1
+                self.LoadTilesetNames(loadTilesets)  # block 1
                 self.LoadOptions()  # block 2
                 self.LoadEntrances()  # block 7
                 self.LoadSprites()  # block 8
@@ -345,7 +424,7 @@ class Game:
 
                 # Load the editor metadata
                 if self.block1pos[0] != 0x78:
-                    rddata = course[0x78:self.block1pos[0]]
+                    rddata = memoryview(course)[0x78:self.block1pos[0]]
                     self.LoadMiyamotoInfo(rddata)
 
                 else:
@@ -376,25 +455,37 @@ class Game:
                     if data[1] == 0:
                         self.blocks[i] = b''
                     else:
-                        self.blocks[i] = course[data[0]:data[0] + data[1]]
+                        self.blocks[i] = bytes(course[data[0]:data[0] + data[1]])
 
                 self.block1pos = getblock.unpack_from(course, 0)
 
-            def LoadTilesetNames(self):
+            def LoadTilesetNames(self, loadTilesets=True):
                 """
-                Loads block 1, the tileset names
+                Loads block 1, the tileset names, and the tilesets themselves if loadTilesets is set
                 """
-                data = struct.unpack_from('32s32s32s32s', self.blocks[0])
-                self.tileset0 = bytes_to_string(data[0])
-                self.tileset1 = bytes_to_string(data[1])
-                self.tileset2 = bytes_to_string(data[2])
-                self.tileset3 = bytes_to_string(data[3])
+                self.tileset0, self.tileset1, self.tileset2, self.tileset3 = ReadTilesetNames(self.blocks[0])
+
+                if not loadTilesets:
+                    self.tileset0Obj = self.tileset1Obj = self.tileset2Obj = self.tileset3Obj = None
+                    return
 
                 self.tileset0Obj = LoadTileset(0, self.tileset0)
                 self.tileset1Obj = LoadTileset(1, self.tileset1)
                 self.tileset2Obj = LoadTileset(2, self.tileset2)
                 self.tileset3Obj = LoadTileset(3, self.tileset3)
 
+            def GetTilesets(self):
+                """
+                Returns the (name, tileset) pairs of the loaded tilesets, in slot order
+                """
+                tilesets = []
+                for name, tilesetObj in ((self.tileset0, self.tileset0Obj), (self.tileset1, self.tileset1Obj),
+                                         (self.tileset2, self.tileset2Obj), (self.tileset3, self.tileset3Obj)):
+                    if name and tilesetObj:
+                        tilesets.append((name, tilesetObj))
+
+                return tilesets
+
             def LoadBackgrounds(self):
                 """
                 Loads block 5, the background data
@@ -449,11 +540,8 @@ class Game:
                 self.SavePaths()  # blocks 14 and 15
 
                 # Save the metadata
-                rdata = bytearray(self.Metadata.save())
-                if len(rdata) % 4 != 0:
-                    for i in range(4 - (len(rdata) % 4)):
-                        rdata.append(0)
-                rdata = bytes(rdata)
+                rdata = self.Metadata.save()
+                rdata += b'\0' * (-len(rdata) % 4)
                 if rdata == b'MD2_':
                     rdata = b''
 
@@ -546,6 +634,9 @@ class Game:
                     offset += 28
                 self.bounding = bounding
 
+                # Later entries win if several boundings share an ID
+                boundings = {checkb[4]: checkb for checkb in bounding}
+
                 # Block 5 - Bg data
                 self.bgs = self.LoadBackgrounds()
 
@@ -559,10 +650,7 @@ class Game:
                     dataz = zonestruct.unpack_from(zonedata, offset)
 
                     # Find the proper bounding
-                    boundObj = None
-                    zoneBoundId = dataz[7]
-                    for checkb in self.bounding:
-                        if checkb[4] == zoneBoundId: boundObj = checkb
+                    boundObj = boundings.get(dataz[7])
 
                     # Find the proper bg
                     try:
@@ -628,6 +716,10 @@ class Game:
                 """
                 Loads blocks 14 and 15, the paths
                 """
+                # Decode every node of block 15 in one go, each path
+                # then takes its own slice of the shared node list
+                nodes = self.LoadPathNodes()
+
                 pathdata = self.blocks[13]
                 pathcount = len(pathdata) // 12
                 pathstruct = struct.Struct('<BbHHHxxxx')  # updated struct -- MrRean
@@ -636,42 +728,19 @@ class Game:
                 pathinfo = []
                 for i in range(pathcount):
                     data = unpack(pathdata, offset)
-
-                    nodes = self.LoadPathNodes(data[2], data[3])
-                    add2p = {'id': int(data[0]),
-                             'unk1': int(data[1]),  # no idea what this is
-                             'nodes': [node for node in nodes],
-                             'loops': data[4] == 2,
-                             }
-                    pathinfo.append(add2p)
-
+                    pathinfo.append(PathItem(data[0], data[1], nodes[data[2]:data[2] + data[3]], data[4] == 2))
                     offset += 12
 
                 self.pathdata = pathinfo
 
-            def LoadPathNodes(self, startindex, count):
+            def LoadPathNodes(self):
                 """
                 Loads block 15, the path nodes
                 """
-                ret = []
                 nodedata = self.blocks[14]
-                nodestruct = struct.Struct('<HHffhHBBBx')
-                offset = startindex * 20
-                unpack = nodestruct.unpack_from
-                for i in range(count):
-                    data = unpack(nodedata, offset)
-                    ret.append({'x': int(data[0]),
-                                'y': int(data[1]),
-                                'speed': float(data[2]),
-                                'accel': float(data[3]),
-                                'delay': int(data[4]),
-                                'unk1': int(data[5]),
-                                'unk2': int(data[6]),
-                                'unk3': int(data[7]),
-                                'unk4': int(data[8]),
-                                })
-                    offset += 20
-                return ret
+                nodedata = nodedata[:len(nodedata) - len(nodedata) % 20]
+                obj = PathNodeItem
+                return [obj(*data) for data in struct.iter_unpack('<HHffhHBBBx', nodedata)]
 
             def SaveTilesetNames(self):
                 """
@@ -744,42 +813,33 @@ class Game:
                 Saves the paths back to block 14 and 15
                 """
                 pathstruct = struct.Struct('>BbHHHxxxx')
-                nodecount = 0
-                for path in self.pathdata:
-                    nodecount += len(path['nodes'])
-                nodebuffer = bytearray(nodecount * 20)
-                nodeoffset = 0
-                nodeindex = 0
-                offset = 0
                 pathcount = len(self.pathdata)
                 buffer = bytearray(pathcount * 12)
-
+                offset = 0
+                nodes = []
                 for path in self.pathdata:
-                    if len(path['nodes']) < 1: continue
+                    if len(path.nodes) < 1: continue
 
-                    self.WritePathNodes(nodebuffer, nodeoffset, path['nodes'])
-
-                    pathstruct.pack_into(buffer, offset, int(path['id']), 0, int(nodeindex), int(len(path['nodes'])),
-                                         2 if path['loops'] else 0)
+                    pathstruct.pack_into(buffer, offset, path.id, 0, len(nodes), len(path.nodes),
+                                         2 if path.loops else 0)
+                    nodes += path.nodes
                     offset += 12
-                    nodeoffset += len(path['nodes']) * 20
-                    nodeindex += len(path['nodes'])
 
                 self.blocks[13] = bytes(buffer)
-                self.blocks[14] = bytes(nodebuffer)
+                self.blocks[14] = self.SavePathNodes(nodes)
 
-            def WritePathNodes(self, buffer, offst, nodes):
+            @staticmethod
+            def SavePathNodes(nodes):
                 """
-                Writes the path node data to the block 15 bytearray
+                Encodes the path nodes to block 15 in a single pack
                 """
-                offset = int(offst)
-
-                nodestruct = struct.Struct('>HHffhHBBBx')
+                values = []
+                extend = values.extend
+                getter = attrgetter(*PathNodeItem.__slots__)
                 for node in nodes:
-                    nodestruct.pack_into(buffer, offset, int(node['x']), int(node['y']), float(node['speed']),
-                                         float(node['accel']), int(node['delay']), int(node['unk1']), int(node['unk2']),
-                                         int(node['unk3']), int(node['unk4']))
-                    offset += 20
+                    extend(getter(node))
+
+                return struct.pack('>' + 'HHffhHBBBx' * len(nodes), *values)
 
             def SaveSprites(self):
                 """
@@ -825,26 +885,31 @@ class Game:
                 bdngstruct = struct.Struct('>llllHHxxxxxxxx')
                 bgStruct = struct.Struct('>HHHH16sxBxx')
                 zonestruct = struct.Struct('>HHHHHHBBBBxBBxBxBBxBxx')
+                bdngSlots, bdngs = self.GetOptimizedBoundings()
+                bgSlots, bgs = self.GetOptimizedBGs()
+
+                buffer2 = bytearray(28 * len(bdngs))
+                offset = 0
+                for bounding in bdngs:
+                    bdngstruct.pack_into(buffer2, offset, bounding[0], bounding[1], bounding[2], bounding[3],
+                                         offset // 28, bounding[4])
+                    offset += 28
+
+                buffer4 = bytearray(28 * len(bgs))
+                offset = 0
+                for background in bgs:
+                    bgStruct.pack_into(buffer4, offset, offset // 28, *background)
+                    offset += 28
+
+                buffer9 = bytearray(28 * len(self.zones))
                 offset = 0
-                bdngs, bdngcount = self.GetOptimizedBoundings()
-                bgs, bgcount = self.GetOptimizedBGs()
-                zcount = len(self.zones)
-                buffer2 = bytearray(28 * bdngcount)
-                buffer4 = bytearray(28 * bgcount)
-                buffer9 = bytearray(28 * zcount)
                 for z in self.zones:
                     if z.objx < 0: z.objx = 0
                     if z.objy < 0: z.objy = 0
-                    bounding = bdngs[z.id]
-                    bdngstruct.pack_into(buffer2, bounding[4] * 28, bounding[0], bounding[1], bounding[2], bounding[3], bounding[4],
-                                         bounding[5])
-                    background = bgs[z.id]
-                    bgStruct.pack_into(buffer4, background[0] * 28, background[0], background[1], background[2], background[3],
-                                       background[4], background[5])
                     zonestruct.pack_into(buffer9, offset,
                                          z.objx, z.objy, z.width, z.height,
-                                         0, 0, z.id, bounding[4],
-                                         z.cammode, z.camzoom, z.visibility, background[0],
+                                         0, 0, z.id, bdngSlots[z.id],
+                                         z.cammode, z.camzoom, z.visibility, bgSlots[z.id],
                                          z.camtrack, z.music, z.sfxmod, z.type)
                     offset += 28
 
@@ -852,39 +917,33 @@ class Game:
                 self.blocks[4] = bytes(buffer4)
                 self.blocks[9] = bytes(buffer9)
 
+            @staticmethod
+            def InternZoneRecords(zones, key):
+                """
+                Deduplicates a per-zone record in one pass.
+                Returns the zone ID -> table slot mapping and the table itself,
+                with slots assigned in order of the lowest zone ID using them.
+                """
+                index = {}
+                table = []
+                slots = {}
+                for z in sorted(zones, key=attrgetter('id')):
+                    record = key(z)
+                    slot = index.get(record)
+                    if slot is None:
+                        slot = index[record] = len(table)
+                        table.append(record)
+
+                    slots[z.id] = slot
+
+                return slots, table
+
             def GetOptimizedBoundings(self):
-                bdngs = {}
-                bdngstruct = struct.Struct('>llllHHxxxxxxxx')
-                for z in self.zones:
-                    bdng = bdngstruct.pack(z.yupperbound, z.ylowerbound, z.yupperbound2, z.ylowerbound2, 0, z.unknownbnf)
-                    if bdng not in bdngs:
-                        bdngs[bdng] = []
-                    bdngs[bdng].append(z.id)
-                bdngs = sorted(bdngs.items(), key=lambda kv: min(kv[1]))
-                oBdngs = {}
-                for i, bdng in enumerate(bdngs):
-                    for z in self.zones:
-                        if z.id in bdng[1]:
-                            oBdngs[z.id] = *bdngstruct.unpack(bdng[0])[:4], i, bdngstruct.unpack(bdng[0])[5]
-
-                return oBdngs, len(bdngs)
+                return self.InternZoneRecords(self.zones, attrgetter(
+                    'yupperbound', 'ylowerbound', 'yupperbound2', 'ylowerbound2', 'unknownbnf'))
 
             def GetOptimizedBGs(self):
-                bgs = {}
-                bgStruct = struct.Struct('>HHHH16sxBxx')
-                for z in self.zones:
-                    bg = bgStruct.pack(0, z.background[1], z.background[2], z.background[3], z.background[4], z.background[5])
-                    if bg not in bgs:
-                        bgs[bg] = []
-                    bgs[bg].append(z.id)
-                bgs = sorted(bgs.items(), key=lambda kv: min(kv[1]))
-                oBgs = {}
-                for i, bg in enumerate(bgs):
-                    for z in self.zones:
-                        if z.id in bg[1]:
-                            oBgs[z.id] = i, *bgStruct.unpack(bg[0])[1:]
-
-                return oBgs, len(bgs)
+                return self.InternZoneRecords(self.zones, lambda z: tuple(z.background[1:6]))
 
             def SaveLocations(self):
                 """
@@ -901,24 +960,22 @@ class Game:
 
                 self.blocks[10] = bytes(buffer)
 
-        def load(self, data):
+        def load(self, data, workers=1, loadTilesets=True):
             """
             Loads a NSMBU level from bytes data.
+            If workers > 1, the areas are parsed in that many processes.
+            If loadTilesets isn't set, only the names of the tilesets are loaded.
             """
-            arc = SarcLib.SARC_Archive()
-            arc.load(data)
-
-            try:
-                courseFolder = arc['course']
-            except:
-                return False
+            with instrument.stage('sarc', len(data)):
+                arc = sarc.Reader(data)
 
             # Sort the area data
             areaData = {}
-            for file in courseFolder.contents:
-                name, val = file.name, file.data
-
-                if val is None: continue
+            hasCourseFolder = False
+            for name, val in arc.items():
+                if not name.startswith('course/'): continue
+                name = name[7:]
+                hasCourseFolder = True
 
                 if not name.startswith('course'): continue
                 if not name.endswith('.bin'): continue
@@ -946,72 +1003,89 @@ class Game:
                     if thisArea not in areaData: areaData[thisArea] = [None] * 4
                     areaData[thisArea][0] = val
 
+            if not hasCourseFolder:
+                return False
+
             # Create area objects
-            self.areas = []
+            jobs = []
             thisArea = 1
             while thisArea in areaData:
-                course = areaData[thisArea][0]
-                L0 = areaData[thisArea][1]
-                L1 = areaData[thisArea][2]
-                L2 = areaData[thisArea][3]
+                jobs.append((thisArea, *areaData[thisArea], loadTilesets))
+                thisArea += 1
 
-                print("Processing Area %d..." % thisArea)
+            for job in jobs:
+                print("Processing Area %d..." % job[0])
 
-                newarea = self.Area()
-                newarea.areanum = thisArea
-                newarea.load(course, L0, L1, L2)
+            if workers > 1 and len(jobs) > 1:
+                # Views into the archive can't be sent to the workers
+                jobs = [[data if data is None or isinstance(data, (int, bool)) else bytes(data) for data in job] for job in jobs]
 
-                self.areas.append(newarea)
+                with makeExecutor(workers) as executor:
+                    self.areas = list(executor.map(loadArea, *zip(*jobs)))
 
-                thisArea += 1
+            else:
+                self.areas = [loadArea(*job) for job in jobs]
 
             return True
 
-        def save(self):
+        def GetTilesetNames(self):
             """
-            Save the level back to a file
+            Returns the tileset names of every area
             """
+            return [[area.tileset0, area.tileset1, area.tileset2, area.tileset3] for area in self.areas]
 
-            # Make a new archive
-            newArchive = SarcLib.SARC_Archive()
-
-            # Create a folder within the archive
-            courseFolder = SarcLib.Folder('course')
-            newArchive.addFolder(courseFolder)
-
-            outerArchive = SarcLib.SARC_Archive()
+        def save(self, workers=1, tilesetArchives=None):
+            """
+            Save the level back to a file
+            """
+            out = io.BytesIO()
+            self.write(out, workers, tilesetArchives)
+            return out.getvalue()
 
-            # Go through the areas, save them and add them back to the archive
-            for areanum, area in enumerate(self.areas):
-                course, L0, L1, L2 = area.save()
+        @instrument.timed('level.save')
+        def write(self, f, workers=1, tilesetArchives=None):
+            """
+            Save the level straight into the file object f.
+            The archives are laid out first, then the course files and
+            tilesets are streamed into f without building them in memory.
+            If tilesetArchives is given, it maps tileset names to already
+            saved tilesets, which are embedded instead of the loaded ones.
+            """
 
-                if course is not None:
-                    courseFolder.addFile(SarcLib.File('course%d.bin' % (areanum + 1), course))
-                if L0 is not None:
-                    courseFolder.addFile(SarcLib.File('course%d_bgdatL0.bin' % (areanum + 1), L0))
-                if L1 is not None:
-                    courseFolder.addFile(SarcLib.File('course%d_bgdatL1.bin' % (areanum + 1), L1))
-                if L2 is not None:
-                    courseFolder.addFile(SarcLib.File('course%d_bgdatL2.bin' % (areanum + 1), L2))
+            # Each distinct tileset is saved once, by the first area using it
+            tilesets = {}
+            if tilesetArchives is None:
+                for area in self.areas:
+                    for name, tilesetObj in area.GetTilesets():
+                        if name not in tilesets:
+                            tilesets[name] = tilesetObj
 
-                # I need to kick in tileset saving here
-                if area.tileset0 and area.tileset0Obj and not exists(outerArchive, area.tileset0):
-                    outerArchive.addFile(SarcLib.File(area.tileset0, SaveTileset(area.tileset0, area.tileset0Obj)))
+            if workers > 1:
+                with makeExecutor(workers) as executor:
+                    areaJobs = [executor.submit(saveArea, withoutTilesets(area)) for area in self.areas]
+                    tilesetJobs = [executor.submit(SaveTileset, name, tilesetObj) for name, tilesetObj in tilesets.items()]
 
-                if area.tileset1 and area.tileset1Obj and not exists(outerArchive, area.tileset1):
-                    outerArchive.addFile(SarcLib.File(area.tileset1, SaveTileset(area.tileset1, area.tileset1Obj)))
+                    areaData = [job.result() for job in areaJobs]
+                    tilesetData = [job.result() for job in tilesetJobs]
 
-                if area.tileset2 and area.tileset2Obj and not exists(outerArchive, area.tileset2):
-                    outerArchive.addFile(SarcLib.File(area.tileset2, SaveTileset(area.tileset2, area.tileset2Obj)))
+            else:
+                areaData = [saveArea(area) for area in self.areas]
+                tilesetData = [SaveTileset(name, tilesetObj) for name, tilesetObj in tilesets.items()]
 
-                if area.tileset3 and area.tileset3Obj and not exists(outerArchive, area.tileset3):
-                    outerArchive.addFile(SarcLib.File(area.tileset3, SaveTileset(area.tileset3, area.tileset3Obj)))
+            # Add everything to the archives in the same order regardless of how it was saved
+            if tilesetArchives is not None:
+                tilesets = [name for name in GetTilesetSlots(self.GetTilesetNames()) if name in tilesetArchives]
+                tilesetData = [tilesetArchives[name] for name in tilesets]
 
-            outerArchive.addFile(SarcLib.File(self.name, newArchive.save()[0]))
+            makeLevelArchive(self.name, makeCourseArchive(areaData), zip(tilesets, tilesetData)).write(f)
 
-            return outerArchive.save()[0]
+        def saveCourse(self):
+            """
+            Returns the course archive of the level, without its tilesets
+            """
+            return makeCourseArchive([saveArea(area) for area in self.areas]).save()
 
-    def LoadLevel(self, name):
+    def LoadLevel(self, name, workers=1, loadTilesets=True):
         if not os.path.isfile(name):
             return False
 
@@ -1032,7 +1106,7 @@ class Game:
         self.level = self.Level(levelName)
 
         # Load it
-        if not self.level.load(levelData):
+        if not self.level.load(levelData, workers, loadTilesets):
             raise Exception
 
         # If we got this far, everything worked! Return True.
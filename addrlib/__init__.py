@@ -16,9 +16,46 @@ try:
 except:
     from . import addrlib
 
-# Define the functions that can be used
-getDefaultGX2TileMode = addrlib.getDefaultGX2TileMode
-deswizzle = addrlib.deswizzle
-swizzle = addrlib.swizzle
-surfaceGetBitsPerPixel = addrlib.surfaceGetBitsPerPixel
-getSurfaceInfo = addrlib.getSurfaceInfo
+import importlib
+
+
+def _export(module):
+    global addrlib, getDefaultGX2TileMode, deswizzle, swizzle, deswizzleInto, swizzleInto, surfaceGetBitsPerPixel, getSurfaceInfo
+    addrlib = module
+
+    # Define the functions that can be used
+    getDefaultGX2TileMode = addrlib.getDefaultGX2TileMode
+    deswizzle = addrlib.deswizzle
+    swizzle = addrlib.swizzle
+    deswizzleInto = addrlib.deswizzleInto
+    swizzleInto = addrlib.swizzleInto
+    surfaceGetBitsPerPixel = addrlib.surfaceGetBitsPerPixel
+    getSurfaceInfo = addrlib.getSurfaceInfo
+
+
+def getBackend():
+    """
+    Returns the implementation in use, "cython" or "python"
+    """
+    return 'cython' if addrlib.__name__.endswith('_cy') else 'python'
+
+
+def setBackend(name):
+    """
+    Switches to the "cython" or "python" implementation.
+    Raises ImportError if the Cython one can't be built.
+    """
+    if name == 'cython':
+        import pyximport
+        pyximport.install()
+
+        _export(importlib.import_module('.addrlib_cy', __name__))
+
+    elif name == 'python':
+        _export(importlib.import_module('.addrlib', __name__))
+
+    else:
+        raise ValueError("Unknown addrlib backend: %s" % name)
+
+
+_export(addrlib)
@@ -76,8 +76,24 @@ def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
     swizzle: boolen where the data will be swizzled if true, otherwise unswizzled
     """
 
-    bytesPerPixel = bitsPerPixel // 8
     result = bytearray(len(data))
+    swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bitsPerPixel, slice, sample, data, result, swizzle)
+
+    return bytes(result)
+
+
+def swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bitsPerPixel, slice, sample, data, result, swizzle):
+
+    """
+    Same as swizzleSurf(), but writes into result, a writable
+    buffer the size of the output which must be zero filled
+    """
+
+    bytesPerPixel = bitsPerPixel // 8
+    dataSize = len(data)
+    resultSize = len(result)
 
     if format_ in BCn_formats:
         width = (width + 3) // 4
@@ -102,14 +118,12 @@ def swizzleSurf(width, height, depth, format_, aa, use, tileMode, swizzle_,
 
             pos_ = (y * width + x) * bytesPerPixel
 
-            if pos_ + bytesPerPixel <= len(data) and pos + bytesPerPixel <= len(data):
-                if swizzle == 0:
+            if swizzle == 0:
+                if pos + bytesPerPixel <= dataSize and pos_ + bytesPerPixel <= resultSize:
                     result[pos_:pos_ + bytesPerPixel] = data[pos:pos + bytesPerPixel]
 
-                else:
-                    result[pos:pos + bytesPerPixel] = data[pos_:pos_ + bytesPerPixel]
-
-    return bytes(result)
+            elif pos_ + bytesPerPixel <= dataSize and pos + bytesPerPixel <= resultSize:
+                result[pos:pos + bytesPerPixel] = data[pos_:pos_ + bytesPerPixel]
 
 
 def deswizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
@@ -126,6 +140,20 @@ def swizzle(width, height, depth, format_, aa, use, tileMode, swizzle_,
                        slice, sample, data, len(data), True)
 
 
+def deswizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                  pitch, bpp, slice, sample, data, out):
+
+    swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                    slice, sample, data, out, False)
+
+
+def swizzleInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                pitch, bpp, slice, sample, data, out):
+
+    swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                    slice, sample, data, out, True)
+
+
 formatHwInfo = [
     0x00, 0x00, 0x00, 0x01, 0x08, 0x03, 0x00, 0x01, 0x08, 0x01, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01,
     0x00, 0x00, 0x00, 0x01, 0x10, 0x07, 0x00, 0x00, 0x10, 0x03, 0x00, 0x01, 0x10, 0x03, 0x00, 0x01,
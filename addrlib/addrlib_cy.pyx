@@ -87,8 +87,26 @@ cdef bytes swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u3
     """
 
     cdef:
-        u32 bytesPerPixel = bitsPerPixel // 8
         bytearray result = bytearray(dataSize)
+        u8 *resultPtr = result
+
+    swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_,
+                    pitch, bitsPerPixel, slice, sample, data, dataSize, resultPtr, dataSize, swizzle)
+
+    return bytes(result)
+
+
+cdef int swizzleSurfInto(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                         u32 pitch, u32 bitsPerPixel, u32 slice, u32 sample, const u8 *data, u32 dataSize,
+                         u8 *result, u32 resultSize, int swizzle) except -1:
+
+    """
+    Same as swizzleSurf(), but writes into result, a
+    buffer of resultSize bytes which must be zero filled
+    """
+
+    cdef:
+        u32 bytesPerPixel = bitsPerPixel // 8
 
         u32 pipeSwizzle, bankSwizzle, y, x, pos, pos_, n
 
@@ -115,16 +133,16 @@ cdef bytes swizzleSurf(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u3
 
             pos_ = (y * width + x) * bytesPerPixel
 
-            if pos_ + bytesPerPixel <= dataSize and pos + bytesPerPixel <= dataSize:
-                if swizzle == 0:
+            if swizzle == 0:
+                if pos + bytesPerPixel <= dataSize and pos_ + bytesPerPixel <= resultSize:
                     for n in range(bytesPerPixel):
-                        result[pos_ + n] = <u8>data[pos + n]
+                        result[pos_ + n] = data[pos + n]
 
-                else:
-                    for n in range(bytesPerPixel):
-                        result[pos + n] = <u8>data[pos_ + n]
+            elif pos_ + bytesPerPixel <= dataSize and pos + bytesPerPixel <= resultSize:
+                for n in range(bytesPerPixel):
+                    result[pos + n] = data[pos_ + n]
 
-    return bytes(result)
+    return 0
 
 
 cpdef bytes deswizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
@@ -145,6 +163,22 @@ cpdef bytes swizzle(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 u
                        slice, sample, dataArr.data.as_uchars, len(data), 1)
 
 
+cpdef deswizzleInto(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                    u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[:] data, u8[:] out):
+
+    if data.shape[0] and out.shape[0]:
+        swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                        slice, sample, &data[0], data.shape[0], &out[0], out.shape[0], 0)
+
+
+cpdef swizzleInto(u32 width, u32 height, u32 depth, u32 format_, u32 aa, u32 use, u32 tileMode, u32 swizzle_,
+                  u32 pitch, u32 bpp, u32 slice, u32 sample, const u8[:] data, u8[:] out):
+
+    if data.shape[0] and out.shape[0]:
+        swizzleSurfInto(width, height, depth, format_, aa, use, tileMode, swizzle_, pitch, bpp,
+                        slice, sample, &data[0], data.shape[0], &out[0], out.shape[0], 1)
+
+
 cdef u8 formatHwInfo[0x100]
 formatHwInfo[:] = [
     0x00, 0x00, 0x00, 0x01, 0x08, 0x03, 0x00, 0x01, 0x08, 0x01, 0x00, 0x01, 0x00, 0x00, 0x00, 0x01,
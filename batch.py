@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# NSMBUDX to NSMBU Level Converter
+# Batch conversion of a whole Course folder
+
+import argparse
+import hashlib
+import instrument
+import json
+import os
+import struct
+
+from NSMBU import Game, GetLevelTilesetNames, GetTilesetSlots, checkContent
+from pipeline import convertLevels, describeError
+from tileset import GetTextureOptions, GetTilesetFilename, LoadTileset, SaveTileset, SetTextureOptions, SetTilesetPath, WriteTilesetArchive
+
+
+# Bump this whenever a change to the converter changes its output,
+# so incremental runs convert everything again
+CONVERTER_VERSION = 5
+
+
+def hashFile(filename):
+    """
+    Returns the SHA-1 of a file, or None if it doesn't exist
+    """
+    if not os.path.isfile(filename):
+        return None
+
+    h = hashlib.sha1()
+    with open(filename, 'rb') as inf:
+        for chunk in iter(lambda: inf.read(0x100000), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
+
+
+class Manifest:
+    """
+    Records, for every converted level, the hashes of the inputs
+    it was converted from, so unchanged levels can be skipped
+    """
+
+    def __init__(self, filename, settings):
+        self.filename = filename
+        self.settings = settings
+        self.levels = {}
+
+        # (filename, mtime, size) -> hash of the tilesets hashed this run
+        self.tilesetHashes = {}
+
+        if os.path.isfile(filename):
+            with open(filename, encoding='utf-8') as inf:
+                manifest = json.load(inf)
+
+            # A different converter or different output settings make everything stale
+            if manifest.get('version') == CONVERTER_VERSION and manifest.get('settings') == settings:
+                self.levels = manifest['levels']
+
+    def isUpToDate(self, name, levelHash, outName):
+        """
+        Returns True if the level was converted from the same inputs
+        and its output is still there
+        """
+        entry = self.levels.get(name)
+        if entry is None or entry['input'] != levelHash or entry['output'] != os.path.basename(outName):
+            return False
+
+        if not os.path.isfile(outName):
+            return False
+
+        for tileset, tilesetHash in entry['tilesets'].items():
+            if self.hashTileset(tileset) != tilesetHash:
+                return False
+
+        return True
+
+    def record(self, name, levelHash, outName, tilesets):
+        self.levels[name] = {
+            'input': levelHash,
+            'output': os.path.basename(outName),
+            'tilesets': {tileset: self.hashTileset(tileset) for tileset in tilesets},
+        }
+
+    def hashTileset(self, tileset):
+        """
+        Returns the hash of a tileset file. Shared tilesets are used by
+        many levels, so every file is only hashed once unless it changes.
+        """
+        filename = GetTilesetFilename(tileset)
+        try:
+            stat = os.stat(filename)
+
+        except OSError:
+            return None
+
+        key = (filename, stat.st_mtime_ns, stat.st_size)
+        if key not in self.tilesetHashes:
+            self.tilesetHashes[key] = hashFile(filename)
+
+        return self.tilesetHashes[key]
+
+    def save(self):
+        """
+        Writes the manifest, replacing the old one only once it's complete
+        """
+        tmpName = self.filename + '.tmp'
+        with open(tmpName, 'w', encoding='utf-8') as out:
+            json.dump({'version': CONVERTER_VERSION, 'settings': self.settings, 'levels': self.levels},
+                      out, indent=2, sort_keys=True)
+
+        os.replace(tmpName, self.filename)
+
+
+def buildDependencyIndex(courseDir):
+    """
+    Reads block 1 of every area of every level in courseDir, without
+    loading the levels or their tilesets, and returns the dependency graph:
+    {'levels': {level: {'file': filename, 'tilesets': {tileset: slot}}},
+     'tilesets': {tileset: [levels]}}
+    where slot is the slot the level first uses the tileset in.
+    """
+    levels = {}
+    for fname in sorted(os.listdir(courseDir)):
+        filename = os.path.join(courseDir, fname)
+        if not os.path.isfile(filename):
+            continue
+
+        with open(filename, 'rb') as inf:
+            data = inf.read()
+
+        if not checkContent(data):
+            continue
+
+        name = os.path.splitext(fname)[0]
+        try:
+            slots = GetTilesetSlots(GetLevelTilesetNames(data))
+
+        except (ValueError, struct.error) as e:
+            print("Warning!!! %s could not be indexed: %s" % (name, e))
+            continue
+
+        levels[name] = {'file': fname, 'tilesets': slots}
+
+    tilesets = {}
+    for name, level in levels.items():
+        for tileset in level['tilesets']:
+            tilesets.setdefault(tileset, []).append(name)
+
+    return {'levels': levels, 'tilesets': tilesets}
+
+
+def scheduleLevels(index, names):
+    """
+    Orders the levels so the ones sharing tilesets are converted
+    one after another, most widely used tilesets first, which lets
+    the tileset cache drop every tileset as early as possible
+    """
+    popularity = {tileset: len(levels) for tileset, levels in index['tilesets'].items()}
+
+    def key(name):
+        tilesets = index['levels'][name]['tilesets']
+        return sorted(tilesets, key=lambda tileset: (-popularity[tileset], tileset)), name
+
+    return sorted(names, key=key)
+
+
+class TilesetCache:
+    """
+    Converts every tileset once, no matter how many levels use it,
+    and keeps it only until the last level using it has been converted.
+    Tilesets first used in slot 0 also carry the animations,
+    so they are cached separately from the ones that don't.
+    """
+
+    def __init__(self):
+        self.refs = {}
+        self.archives = {}
+
+    @staticmethod
+    def keys(slots):
+        return [(name, slot == 0) for name, slot in slots.items()]
+
+    def addLevel(self, slots):
+        """
+        Registers a level that's going to be converted
+        """
+        for key in self.keys(slots):
+            self.refs[key] = self.refs.get(key, 0) + 1
+
+    def get(self, slots):
+        """
+        Returns {name: saved tileset} for a level,
+        converting the tilesets that aren't cached yet
+        """
+        archives = {}
+        for key in self.keys(slots):
+            if key not in self.archives:
+                name, anims = key
+                self.archives[key] = SaveTileset(name, LoadTileset(0 if anims else 1, name))
+
+            archives[key[0]] = self.archives[key]
+
+        return archives
+
+    def release(self, slots):
+        """
+        Drops the tilesets no other pending level uses
+        """
+        for key in self.keys(slots):
+            self.refs[key] -= 1
+            if not self.refs[key]:
+                del self.refs[key]
+                self.archives.pop(key, None)
+
+
+def convertLevel(filename, outName, workers=1, tilesetArchives=None):
+    """
+    Converts a single level, returns the loaded level or None.
+    If tilesetArchives is given, the level's tilesets are taken from
+    it instead of being loaded and converted along with the level.
+    """
+    game = Game()
+    if not game.LoadLevel(filename, workers, tilesetArchives is None):
+        return None
+
+    with open(outName, 'wb') as out:
+        game.level.write(out, workers, tilesetArchives)
+
+    return game.level
+
+
+def hasSharedTileset(unitDir, name):
+    """
+    Returns True if a shared tileset was already written to unitDir
+    """
+    return os.path.isfile(os.path.join(unitDir, name + '.szs')) or os.path.isfile(os.path.join(unitDir, name + '.sarc'))
+
+
+def convertSharedTilesets(index, names, unitDir):
+    """
+    Converts every tileset used by the given levels once,
+    writing it to unitDir for all levels to share.
+    Returns the tilesets that couldn't be converted.
+    """
+    tilesets = sorted({tileset for name in names for tileset in index['levels'][name]['tilesets']})
+
+    failed = set()
+    for tileset in tilesets:
+        print("Converting tileset %s..." % tileset)
+        try:
+            # Always keep the animations, any level might use it in slot 0
+            WriteTilesetArchive(tileset, SaveTileset(tileset, LoadTileset(0, tileset)), unitDir)
+
+        except Exception as e:
+            # One bad tileset only fails the levels using it
+            print("Warning!!! Tileset %s could not be converted: %s" % (tileset, describeError(e)))
+            failed.add(tileset)
+
+    return failed
+
+
+def writeIndex(index, filename):
+    with open(filename, 'w', encoding='utf-8') as out:
+        json.dump(index, out, indent=2, sort_keys=True)
+
+
+def convertWithPipeline(index, names, courseDir, outDir, manifest, workers=1, sharedTilesets=False):
+    """
+    Converts the levels through an asyncio Pipeline, using workers
+    processes for whole levels, returns how many were converted
+    """
+    jobs = []
+    for name in names:
+        level = index['levels'][name]
+        jobs.append((name, os.path.join(courseDir, level['file']), os.path.join(outDir, name + '.sarc'), level['tilesets']))
+
+    converted = 0
+
+    def onLevel(job, error):
+        nonlocal converted
+        if error is not None:
+            return
+
+        # Save after every level, so an interrupted run keeps the finished ones
+        name, filename, outName, slots = job
+        manifest.record(name, hashFile(filename), outName, sorted(slots))
+        manifest.save()
+        converted += 1
+
+    convertLevels(jobs, workers, embedTilesets=not sharedTilesets, onLevel=onLevel)
+    return converted
+
+
+def convertCourseFolder(courseDir, unitDir, outDir, incremental=False, workers=1, index=None,
+                        sharedTilesets=False, pipeline=False):
+    """
+    Converts every level in courseDir, writing them to outDir.
+    If incremental is set, levels whose inputs didn't change
+    since the last run are skipped.
+    Every tileset is converted once and shared by all levels using it.
+    If sharedTilesets is set, the tilesets are written once to a "Unit"
+    folder inside outDir and the levels only contain the course data,
+    otherwise each level embeds the tilesets it uses.
+    If pipeline is set, the levels are converted through an asyncio
+    Pipeline, workers being the number of levels converted at once.
+    """
+    SetTilesetPath(unitDir)
+    os.makedirs(outDir, exist_ok=True)
+
+    if index is None:
+        index = buildDependencyIndex(courseDir)
+
+    # The number of encoding processes doesn't change the output
+    textures = GetTextureOptions()
+    del textures['encodeWorkers']
+
+    manifest = Manifest(os.path.join(outDir, 'manifest.json'),
+                        {'sharedTilesets': sharedTilesets, 'textures': textures})
+    sharedDir = os.path.join(outDir, 'Unit')
+
+    pending = []
+    skipped = 0
+    for name, level in index['levels'].items():
+        filename = os.path.join(courseDir, level['file'])
+        outName = os.path.join(outDir, name + '.sarc')
+        levelHash = hashFile(filename)
+
+        if incremental and manifest.isUpToDate(name, levelHash, outName):
+            if not sharedTilesets or all(hasSharedTileset(sharedDir, tileset) for tileset in level['tilesets']):
+                skipped += 1
+                continue
+
+        pending.append(name)
+
+    scheduled = scheduleLevels(index, pending)
+    if sharedTilesets:
+        os.makedirs(sharedDir, exist_ok=True)
+        failed = convertSharedTilesets(index, pending, sharedDir)
+
+        for name in scheduled[:]:
+            if failed.intersection(index['levels'][name]['tilesets']):
+                print("Warning!!! %s could not be converted: it uses a tileset that failed" % name)
+                scheduled.remove(name)
+
+    if pipeline:
+        converted = convertWithPipeline(index, scheduled, courseDir, outDir, manifest, workers, sharedTilesets)
+        print("Converted %d levels, skipped %d unchanged levels" % (converted, skipped))
+        return
+
+    # Only count the references of the levels that are actually converted
+    cache = TilesetCache()
+    if not sharedTilesets:
+        for name in scheduled:
+            cache.addLevel(index['levels'][name]['tilesets'])
+
+    converted = 0
+    for name in scheduled:
+        level = index['levels'][name]
+        slots = level['tilesets']
+        filename = os.path.join(courseDir, level['file'])
+        outName = os.path.join(outDir, name + '.sarc')
+        levelHash = hashFile(filename)
+
+        print("Converting %s..." % name)
+        instrument.beginLevel(name)
+        try:
+            # Levels using shared tilesets only contain the course data
+            tilesetArchives = {} if sharedTilesets else cache.get(slots)
+            loaded = convertLevel(filename, outName, workers, tilesetArchives)
+
+        except Exception as e:
+            # One bad level or tileset only fails this level
+            print("Warning!!! %s could not be converted: %s" % (name, describeError(e)))
+            continue
+
+        finally:
+            instrument.endLevel()
+            if not sharedTilesets:
+                cache.release(slots)
+
+        if loaded is None:
+            print("Warning!!! %s could not be loaded!" % name)
+            continue
+
+        manifest.record(name, levelHash, outName, sorted(slots))
+        manifest.save()
+        converted += 1
+
+    print("Converted %d levels, skipped %d unchanged levels" % (converted, skipped))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert every NSMBUDX level in a Course folder to NSMBU.')
+    parser.add_argument('course', help='the romfs "Course" folder')
+    parser.add_argument('unit', help='the romfs "Unit" folder')
+    parser.add_argument('output', help='the folder to write the converted levels to')
+    parser.add_argument('--incremental', action='store_true', help='skip levels whose inputs did not change since the last run')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes to use per level, or in total with --pipeline')
+    parser.add_argument('--shared-tilesets', action='store_true',
+                        help='write every tileset once to OUTPUT/Unit instead of embedding them in each level')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='convert several levels at once, overlapping file I/O with the conversion')
+    parser.add_argument('--mips', type=int, default=1, help='number of mip levels to generate for the tileset textures')
+    parser.add_argument('--compress', choices=('bc', 'bc1', 'bc3'),
+                        help='block compress the tileset textures, "bc" picking BC1 for opaque ones and BC3 otherwise')
+    parser.add_argument('--encode-workers', type=int, default=1,
+                        help='number of processes encoding each texture, the --pipeline workers encode theirs themselves')
+    parser.add_argument('--timing', metavar='FILE',
+                        help='write per-stage timings to FILE (stages run in worker processes are not included)')
+    parser.add_argument('--memory', action='store_true',
+                        help='also write the peak memory and top allocation sites of every stage to the --timing file (slow)')
+    parser.add_argument('--index', metavar='FILE', help='write the level/tileset dependency index to FILE')
+    parser.add_argument('--index-only', action='store_true', help='only build the dependency index, convert nothing')
+    args = parser.parse_args()
+
+    if args.memory and not args.timing:
+        parser.error('--memory needs --timing')
+
+    index = buildDependencyIndex(args.course)
+    if args.index:
+        writeIndex(index, args.index)
+
+    if args.index_only:
+        return
+
+    SetTextureOptions(mips=args.mips, compression=args.compress, encodeWorkers=args.encode_workers)
+
+    if args.timing:
+        instrument.enable(args.memory)
+
+    convertCourseFolder(args.course, args.unit, args.output, args.incremental, args.workers, index,
+                        args.shared_tilesets, args.pipeline)
+
+    if args.timing:
+        instrument.writeReport(args.timing)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# bcn.py
+# A small BC1/BC3 (DXT1/DXT5) encoder for RGBA8 images,
+# its block loop running in Cython (bcn_cy.pyx) when it can be built
+
+
+################################################################
+################################################################
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import struct
+
+
+# GX2 formats of the encodings
+BC1_FORMAT = 0x31
+BC3_FORMAT = 0x33
+
+# Bytes per 4x4 block
+blockSizes = {BC1_FORMAT: 8, BC3_FORMAT: 16}
+
+# BC1 index of the palette entry at 0, 1/3, 2/3 and 1 of the way from color0 to color1
+_colorIndices = (0, 2, 3, 1)
+
+# BC3 alpha index of the palette entry at 0, 1/7, ..., 1 of the way from alpha0 to alpha1
+_alphaIndices = (0, 2, 3, 4, 5, 6, 7, 1)
+
+_colorBlock = struct.Struct('<HHI')
+
+
+def isOpaque(data):
+    """
+    Returns True if every pixel of an RGBA8 image is opaque
+    """
+    return data[3::4] == b'\xFF' * (len(data) // 4)
+
+
+def getFormat(data, compression):
+    """
+    Returns the GX2 format an image is encoded to, compression
+    being "bc1", "bc3" or "bc" to pick BC1 for opaque images
+    and BC3 for the ones with alpha
+    """
+    if compression == 'bc1':
+        return BC1_FORMAT
+
+    elif compression == 'bc3':
+        return BC3_FORMAT
+
+    elif compression == 'bc':
+        return BC1_FORMAT if isOpaque(data) else BC3_FORMAT
+
+    raise ValueError("Unknown compression: %s" % compression)
+
+
+def to565(r, g, b):
+    return ((r * 31 + 127) // 255) << 11 | ((g * 63 + 127) // 255) << 5 | (b * 31 + 127) // 255
+
+
+def from565(color):
+    r = color >> 11
+    g = (color >> 5) & 0x3F
+    b = color & 0x1F
+
+    return (r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)
+
+
+def encodeColorBlock(rs, gs, bs):
+    """
+    Encodes the colors of 16 pixels to a BC1 color block (4 color mode).
+    The endpoints are the corners of their bounding box, inset a bit.
+    """
+    minR, maxR = min(rs), max(rs)
+    minG, maxG = min(gs), max(gs)
+    minB, maxB = min(bs), max(bs)
+
+    insetR = (maxR - minR) >> 4
+    insetG = (maxG - minG) >> 4
+    insetB = (maxB - minB) >> 4
+
+    color0 = to565(maxR - insetR, maxG - insetG, maxB - insetB)
+    color1 = to565(minR + insetR, minG + insetG, minB + insetB)
+
+    if color0 == color1:
+        return _colorBlock.pack(color0, color1, 0)
+
+    # color0 > color1 selects the 4 color mode
+    if color0 < color1:
+        color0, color1 = color1, color0
+
+    r0, g0, b0 = from565(color0)
+    r1, g1, b1 = from565(color1)
+    dr, dg, db = r1 - r0, g1 - g0, b1 - b0
+
+    # Project every pixel on the line between the endpoints
+    denom = (dr * dr + dg * dg + db * db) * 2
+    indices = 0
+    for i in range(15, -1, -1):
+        t = (((rs[i] - r0) * dr + (gs[i] - g0) * dg + (bs[i] - b0) * db) * 6 + denom // 2) // denom
+        indices = indices << 2 | _colorIndices[0 if t < 0 else 3 if t > 3 else t]
+
+    return _colorBlock.pack(color0, color1, indices)
+
+
+def encodeAlphaBlock(alphas):
+    """
+    Encodes the alpha of 16 pixels to a BC3 alpha block (8 alpha mode)
+    """
+    alpha0 = max(alphas)
+    alpha1 = min(alphas)
+
+    indices = 0
+    if alpha0 != alpha1:
+        span = alpha0 - alpha1
+        for i in range(15, -1, -1):
+            indices = indices << 3 | _alphaIndices[((alpha0 - alphas[i]) * 14 + span) // (span * 2)]
+
+    return bytes((alpha0, alpha1)) + indices.to_bytes(6, 'little')
+
+
+def padImage(data, width, height):
+    """
+    Pads an RGBA8 image to a multiple of 4 pixels in both
+    directions, repeating its last column and row
+    """
+    paddedWidth = (width + 3) & ~3
+    paddedHeight = (height + 3) & ~3
+    if (paddedWidth, paddedHeight) == (width, height):
+        return data
+
+    stride = width * 4
+    rows = []
+    for y in range(height):
+        row = data[y * stride:(y + 1) * stride]
+        rows.append(bytes(row) + bytes(row[-4:]) * (paddedWidth - width))
+
+    rows += [rows[-1]] * (paddedHeight - height)
+    return b''.join(rows)
+
+
+def encodeRows(data, width, format_):
+    """
+    Encodes rows of 4x4 blocks, data being the RGBA8 pixels
+    of a multiple of 4 rows of an image padded to a multiple
+    of 4 pixels wide (runs in a worker when encoding in parallel)
+    """
+    pixels = memoryview(data).cast('I')
+    blocksWide = width // 4
+    blocks = []
+
+    for blockY in range(len(pixels) // width // 4):
+        rows = [pixels[(blockY * 4 + y) * width:(blockY * 4 + y + 1) * width] for y in range(4)]
+
+        for blockX in range(blocksWide):
+            x = blockX * 4
+            block = [*rows[0][x:x + 4], *rows[1][x:x + 4], *rows[2][x:x + 4], *rows[3][x:x + 4]]
+
+            color = encodeColorBlock([p & 0xFF for p in block], [p >> 8 & 0xFF for p in block],
+                                     [p >> 16 & 0xFF for p in block])
+
+            if format_ == BC3_FORMAT:
+                blocks.append(encodeAlphaBlock([p >> 24 for p in block]))
+
+            blocks.append(color)
+
+    return b''.join(blocks)
+
+
+# The block loop in use, the Cython one if it can be built
+_encodeRows = encodeRows
+
+try:
+    import pyximport; pyximport.install()
+    import bcn_cy
+    _encodeRows = bcn_cy.encodeRows
+
+except:
+    pass
+
+
+def getBackend():
+    """
+    Returns the block loop in use, "cython" or "python"
+    """
+    return 'python' if _encodeRows is encodeRows else 'cython'
+
+
+def setBackend(name):
+    """
+    Switches to the "cython" or "python" block loop.
+    Raises ImportError if the Cython one can't be built.
+    """
+    global _encodeRows
+
+    if name == 'cython':
+        import pyximport; pyximport.install()
+        import bcn_cy
+        _encodeRows = bcn_cy.encodeRows
+
+    elif name == 'python':
+        _encodeRows = encodeRows
+
+    else:
+        raise ValueError("Unknown BCn backend: %s" % name)
+
+
+# The encoding processes, started once per process and reused for every texture
+_executor = None
+_executorWorkers = 0
+_executorPid = None
+
+
+def getExecutor(workers):
+    """
+    Returns the process pool encoding the textures, only starting a new
+    one if there's none of that size in this process yet. Forked processes
+    inherit the pool of their parent, but can't use it, so they start
+    their own.
+    """
+    global _executor, _executorWorkers, _executorPid
+
+    if _executorPid != os.getpid():
+        _executor = None
+
+    if _executor is None or _executorWorkers != workers:
+        if _executor is not None:
+            _executor.shutdown()
+
+        _executor = ProcessPoolExecutor(workers)
+        _executorWorkers = workers
+        _executorPid = os.getpid()
+
+    return _executor
+
+
+def encode(data, width, height, format_, workers=1):
+    """
+    Encodes an RGBA8 image to BC1 or BC3, in workers processes.
+    Returns the blocks, row by row.
+    """
+    if format_ not in blockSizes:
+        raise ValueError("Unsupported format: 0x%x" % format_)
+
+    data = padImage(data, width, height)
+    width = (width + 3) & ~3
+    height = (height + 3) & ~3
+
+    blockRows = height // 4
+    if workers <= 1 or blockRows < 2:
+        return _encodeRows(data, width, format_)
+
+    # Hand out a few chunks of block rows per worker
+    chunkRows = max(1, blockRows // (workers * 4))
+    chunkSize = width * 4 * 4 * chunkRows
+    chunks = [data[pos:pos + chunkSize] for pos in range(0, len(data), chunkSize)]
+
+    executor = getExecutor(workers)
+    return b''.join(executor.map(_encodeRows, chunks, [width] * len(chunks), [format_] * len(chunks)))
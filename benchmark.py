@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# benchmark.py
+# Micro-benchmarks of the conversion hot paths
+# and end-to-end level conversion timings
+
+
+################################################################
+################################################################
+
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import addrlib
+import bcn
+import bntx as BNTX
+import fixtures
+import gtx
+import sarc
+from NSMBU import Game, checkContent, loadArea, saveArea
+from tileset import DecompYaz0, LoadTilesetData, SaveTileset, loadBNTXFromBFRES
+from yaz0 import libyaz0_available
+
+
+def measure(func, repeat):
+    """
+    Calls func repeat times, returns the time each call took
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return times
+
+
+def makeResult(name, times, nbytes=0, objects=0):
+    """
+    Summarizes the times of a benchmark, nbytes and objects
+    being the amount of work done by a single call
+    """
+    median = statistics.median(times)
+    result = {
+        'name': name,
+        'times': times,
+        'min': min(times),
+        'median': median,
+        'bytes': nbytes,
+        'objects': objects,
+    }
+
+    if nbytes and median:
+        result['MB/s'] = nbytes / median / 1000000
+
+    if objects and median:
+        result['objects/s'] = objects / median
+
+    return result
+
+
+def randomBytes(size, seed=0):
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def benchSwizzle(sizes, repeat):
+    """
+    bntx swizzle/deswizzle of RGBA8 surfaces, block linear and linear
+    """
+    results = []
+    for size in sizes:
+        data = randomBytes(size * size * 4)
+
+        for tileMode, modeName in ((0, 'blocklinear'), (1, 'linear')):
+            if tileMode == 0:
+                blockHeightLog2 = len(bin(BNTX.swizzle.getBlockHeight(size))[2:]) - 1
+
+            else:
+                blockHeightLog2 = 0
+
+            swizzled = BNTX.swizzle.swizzle(size, size, 1, 1, 1, 4, tileMode, blockHeightLog2, data)
+
+            results.append(makeResult('swizzle.%s.%d' % (modeName, size), measure(
+                lambda: BNTX.swizzle.swizzle(size, size, 1, 1, 1, 4, tileMode, blockHeightLog2, data), repeat), len(data)))
+
+            results.append(makeResult('deswizzle.%s.%d' % (modeName, size), measure(
+                lambda: BNTX.swizzle.deswizzle(size, size, 1, 1, 1, 4, tileMode, blockHeightLog2, swizzled), repeat), len(data)))
+
+    return results
+
+
+def benchAddrlib(sizes, repeat):
+    """
+    addrlib swizzle/deswizzle of RGBA8 surfaces, linear and 2D tiled,
+    and getSurfaceInfo
+    """
+    results = []
+    for size in sizes:
+        for tileMode, modeName in ((1, 'linear'), (4, 'tiled')):
+            surfOut = addrlib.getSurfaceInfo(0x1a, size, size, 1, 1, tileMode, 0, 0)
+            data = randomBytes(surfOut.surfSize)
+
+            swizzled = addrlib.swizzle(size, size, 1, 0x1a, 0, 1, surfOut.tileMode, 0,
+                                       surfOut.pitch, surfOut.bpp, 0, 0, data)
+
+            results.append(makeResult('addrlib.swizzle.%s.%d' % (modeName, size), measure(
+                lambda: addrlib.swizzle(size, size, 1, 0x1a, 0, 1, surfOut.tileMode, 0,
+                                        surfOut.pitch, surfOut.bpp, 0, 0, data), repeat), len(data)))
+
+            results.append(makeResult('addrlib.deswizzle.%s.%d' % (modeName, size), measure(
+                lambda: addrlib.deswizzle(size, size, 1, 0x1a, 0, 1, surfOut.tileMode, 0,
+                                          surfOut.pitch, surfOut.bpp, 0, 0, swizzled), repeat), len(data)))
+
+    # Every tile mode, a few formats and sizes and all mip levels of them
+    cases = [(format_, size, tileMode, level)
+             for format_ in (0x1a, 0x31, 0x33)
+             for size in (16, 256, 1024)
+             for tileMode in (1, 2, 4, 7, 16)
+             for level in range(4)]
+
+    def getSurfaceInfos():
+        for format_, size, tileMode, level in cases:
+            addrlib.getSurfaceInfo(format_, size, size, 1, 1, tileMode, 0, level)
+
+    results.append(makeResult('addrlib.getSurfaceInfo', measure(getSurfaceInfos, repeat), objects=len(cases)))
+    return results
+
+
+def benchGTX(sizes, repeat):
+    """
+    gtx.writeGFD, swizzling RGBA8 surfaces into GTX files,
+    and encoding them to BC3 first
+    """
+    results = []
+    for size in sizes:
+        data = randomBytes(size * size * 4)
+        results.append(makeResult('gtx.writeGFD.%d' % size, measure(
+            lambda: gtx.writeGFD(data, size, size, [0, 1, 2, 3]), repeat), len(data)))
+
+        results.append(makeResult('gtx.writeGFD.bc3.%d' % size, measure(
+            lambda: gtx.writeGFD(data, size, size, [0, 1, 2, 3], format_=0x33), repeat), len(data)))
+
+    return results
+
+
+def benchBCn(sizes, repeat):
+    """
+    bcn.encode of RGBA8 images to BC1 and BC3
+    """
+    results = []
+    for size in sizes:
+        data = randomBytes(size * size * 4)
+
+        for format_, formatName in ((bcn.BC1_FORMAT, 'bc1'), (bcn.BC3_FORMAT, 'bc3')):
+            results.append(makeResult('bcn.encode.%s.%d' % (formatName, size), measure(
+                lambda: bcn.encode(data, size, size, format_), repeat), len(data)))
+
+    return results
+
+
+def benchYaz0(repeat):
+    """
+    libyaz0 compression and decompression of semi-compressible data
+    """
+    if not libyaz0_available:
+        return []
+
+    from libyaz0 import compress, decompress
+
+    # Half random, half runs, roughly like a tileset archive
+    data = b''.join(randomBytes(0x1000, i) + bytes([i & 0xFF]) * 0x1000 for i in range(64))
+    compressed = compress(data, 0, 1)
+
+    return [
+        makeResult('yaz0.compress', measure(lambda: compress(data, 0, 1), repeat), len(data)),
+        makeResult('yaz0.decompress', measure(lambda: decompress(compressed), repeat), len(data)),
+    ]
+
+
+def splitLevel(data):
+    """
+    Returns {area number: (course, L0, L1, L2)} of a level
+    """
+    arc = sarc.Reader(data)
+
+    areas = {}
+    areanum = 1
+    while 'course/course%d.bin' % areanum in arc:
+        areas[areanum] = (arc['course/course%d.bin' % areanum],) + tuple(
+            arc.get('course/course%d_bgdatL%d.bin' % (areanum, layer)) for layer in range(3))
+
+        areanum += 1
+
+    return areas
+
+
+def benchAreas(levels, repeat):
+    """
+    Area.load and Area.save over all areas of the given levels,
+    in objects (sprites, layer objects, zones, paths...) per second
+    """
+    jobs = []
+    for name, data in levels:
+        for areanum, files in splitLevel(data).items():
+            jobs.append((areanum,) + files)
+
+    if not jobs:
+        return []
+
+    areas = [loadArea(*job, loadTilesets=False) for job in jobs]
+    nbytes = sum(len(f) for job in jobs for f in job[1:] if f is not None)
+    objects = sum(len(area.sprites) + sum(len(layer) for layer in area.layers) + len(area.zones)
+                  + len(area.locations) + len(area.entrances) + len(area.pathdata) for area in areas)
+
+    return [
+        makeResult('area.load', measure(lambda: [loadArea(*job, loadTilesets=False) for job in jobs], repeat), nbytes, objects),
+        makeResult('area.save', measure(lambda: [saveArea(area) for area in areas], repeat), nbytes, objects),
+    ]
+
+
+def benchTilesets(tilesets, repeat):
+    """
+    BNTX loading, deswizzling, whole tileset loading and SaveTileset
+    """
+    results = []
+    for name, szs in tilesets:
+        arc = sarc.Reader(DecompYaz0(szs))
+        bfres = arc['output.bfres']
+        bntx = loadBNTXFromBFRES(bfres)
+        texture = next((tex for tex in bntx.textures if tex.name == name), bntx.textures[0])
+        tilesetObj = LoadTilesetData(0, name, szs)
+
+        results += [
+            makeResult('bntx.load.%s' % name, measure(lambda: loadBNTXFromBFRES(bfres), repeat), len(bfres)),
+            makeResult('bntx.rawData.%s' % name, measure(lambda: bntx.rawData(texture), repeat), texture.imageSize),
+            makeResult('bntx.rawData.base.%s' % name, measure(lambda: bntx.rawData(texture, [0]), repeat),
+                       texture.imageSize),
+            makeResult('tileset.load.%s' % name, measure(lambda: LoadTilesetData(0, name, szs), repeat), len(szs)),
+            makeResult('tileset.save.%s' % name, measure(lambda: SaveTileset(name, tilesetObj), repeat), len(szs)),
+        ]
+
+    return results
+
+
+def benchLevels(levels, repeat):
+    """
+    End-to-end conversion of whole levels, tilesets included
+    """
+    def convert(name, data):
+        level = Game.Level(name)
+        level.load(data)
+        return level.save()
+
+    return [makeResult('level.convert.%s' % name, measure(lambda: convert(name, data), repeat), len(data))
+            for name, data in levels]
+
+
+def loadRomfs(romfs, count):
+    """
+    Reads the first count levels of a romfs "Course" folder
+    and the tilesets they use from its "Unit" folder
+    """
+    from NSMBU import GetLevelTilesetNames, GetTilesetSlots
+    from tileset import GetTilesetFilename, SetTilesetPath
+
+    SetTilesetPath(os.path.join(romfs, 'Unit'))
+    courseDir = os.path.join(romfs, 'Course')
+
+    levels = []
+    tilesets = {}
+    for fname in sorted(os.listdir(courseDir)):
+        if len(levels) >= count:
+            break
+
+        with open(os.path.join(courseDir, fname), 'rb') as inf:
+            data = inf.read()
+
+        if not checkContent(data):
+            continue
+
+        levels.append((os.path.splitext(fname)[0], data))
+        for tileset in GetTilesetSlots(GetLevelTilesetNames(data)):
+            if tileset not in tilesets:
+                with open(GetTilesetFilename(tileset), 'rb') as inf:
+                    tilesets[tileset] = inf.read()
+
+    return levels, sorted(tilesets.items())
+
+
+def runBenchmarks(romfs=None, count=3, repeat=5, quick=False, only=None):
+    """
+    Runs the benchmarks on the levels and tilesets of romfs, or on
+    synthetic ones made by fixtures.py if it isn't given.
+    only filters the benchmarks by name.
+    """
+    sizes = (64, 256) if quick else (64, 256, 1024)
+
+    suites = [
+        ('swizzle', lambda: benchSwizzle(sizes, repeat)),
+        ('addrlib', lambda: benchAddrlib(sizes, repeat)),
+        ('gtx', lambda: benchGTX(sizes, repeat)),
+        ('bcn', lambda: benchBCn(sizes, repeat)),
+        ('yaz0', lambda: benchYaz0(repeat)),
+    ]
+
+    def gameSuites():
+        levels, tilesets = loadRomfs(romfs or tmpDir.name, count)
+        return [
+            ('area', lambda: benchAreas(levels, repeat)),
+            ('tileset', lambda: benchTilesets(tilesets, repeat)),
+            ('level', lambda: benchLevels(levels, repeat)),
+        ]
+
+    tmpDir = None
+    if not only or {'area', 'tileset', 'level'}.intersection(only):
+        if not romfs:
+            tmpDir = tempfile.TemporaryDirectory()
+            fixtures.makeRomfs(tmpDir.name, levels=count, tilesets=2,
+                               tilesetSize=(512, 256) if quick else (2048, 512))
+
+        suites += gameSuites()
+
+    results = []
+    for name, suite in suites:
+        if only and name not in only:
+            continue
+
+        print("Running %s benchmarks..." % name)
+        results += suite()
+
+    if tmpDir is not None:
+        tmpDir.cleanup()
+
+    return {
+        'backends': {'swizzle': BNTX.getSwizzleBackend(), 'addrlib': addrlib.getBackend(), 'bcn': bcn.getBackend()},
+        'results': results,
+    }
+
+
+def printResults(report):
+    print()
+    print('%-40s %12s %12s %14s' % ('benchmark', 'median ms', 'MB/s', 'objects/s'))
+    for result in report['results']:
+        print('%-40s %12.3f %12s %14s' % (
+            result['name'], result['median'] * 1000,
+            '%.2f' % result['MB/s'] if 'MB/s' in result else '',
+            '%.0f' % result['objects/s'] if 'objects/s' in result else '',
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot paths of the converter.')
+    parser.add_argument('--romfs', help='a romfs folder with "Course" and "Unit" (default: synthetic fixtures)')
+    parser.add_argument('--levels', type=int, default=3, help='number of levels to take from the romfs')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed runs of every benchmark')
+    parser.add_argument('--quick', action='store_true', help='skip the largest surfaces and use small fixtures')
+    parser.add_argument('--only', nargs='+', metavar='SUITE',
+                        help='only run these suites (swizzle, addrlib, gtx, bcn, yaz0, area, tileset, level)')
+    parser.add_argument('--json', metavar='FILE', help='write the results to FILE')
+    args = parser.parse_args()
+
+    report = runBenchmarks(args.romfs, args.levels, args.repeat, args.quick, args.only)
+    printResults(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as out:
+            json.dump(report, out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
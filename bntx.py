@@ -3,14 +3,13 @@
 
 # bntx.py
 # A BNTX file reader/writer
+# Only needs the standard library, extracting and replacing
+# textures through the GUI is in bntx_gui.py
 
 
 ################################################################
 ################################################################
 
-import os.path
-from PyQt5 import QtWidgets
-
 from bntx_structs import (
     BNTXHeader, TexContainer, BlockHeader, StringTable,
     TextureInfo, RelocTBL, readInt64, packInt64,
@@ -24,6 +23,33 @@ except:
     import swizzle
 
 
+def getSwizzleBackend():
+    """
+    Returns the swizzle implementation in use, "cython" or "python"
+    """
+    return 'cython' if swizzle.__name__ == 'swizzle_cy' else 'python'
+
+
+def setSwizzleBackend(name):
+    """
+    Switches to the "cython" or "python" swizzle implementation.
+    Raises ImportError if the Cython one can't be built.
+    """
+    global swizzle
+
+    if name == 'cython':
+        import pyximport; pyximport.install()
+        import swizzle_cy as module
+
+    elif name == 'python':
+        import swizzle as module
+
+    else:
+        raise ValueError("Unknown swizzle backend: %s" % name)
+
+    swizzle = module
+
+
 DIV_ROUND_UP = swizzle.DIV_ROUND_UP
 round_up = swizzle.round_up
 pow2_round_up = swizzle.pow2_round_up
@@ -139,7 +165,12 @@ class File:
 
         return 0
 
-    def rawData(self, texture):
+    @staticmethod
+    def getBlockInfo(texture):
+        """
+        Returns the block width, block height and
+        bytes per block of the format of a texture
+        """
         global blk_dims, bpps
 
         if (texture.format_ >> 8) in blk_dims:
@@ -150,8 +181,14 @@ class File:
 
         bpp = bpps[texture.format_ >> 8]
 
-        target = 1 if self.target == "NX  " else 0
-        result_ = []
+        return blkWidth, blkHeight, bpp
+
+    def mipLevels(self, texture):
+        """
+        Yields the mip level, width, height, data size, data
+        offset and blockHeightLog2 of every level of a texture
+        """
+        blkWidth, blkHeight, bpp = self.getBlockInfo(texture)
 
         linesPerBlockHeight = (1 << texture.blockHeightLog2) * 8
         blockHeightShift = 0
@@ -162,152 +199,59 @@ class File:
 
             size = DIV_ROUND_UP(width, blkWidth) * DIV_ROUND_UP(height, blkHeight) * bpp
 
+            # Also for the levels that are skipped, the following ones depend on it
             if pow2_round_up(DIV_ROUND_UP(height, blkHeight)) < linesPerBlockHeight:
                 blockHeightShift += 1
 
-            result = swizzle.deswizzle(
-                width, height, blkWidth, blkHeight, target, bpp, texture.tileMode,
-                max(0, texture.blockHeightLog2 - blockHeightShift), texture.data[mipOffset:],
-            )
-
-            result_.append(result[:size])
-
-        return result_, blkWidth, blkHeight
-
-    def extract(self, index, BFRESPath, exportAs, dontShowMsg=False):
-        global formats, tileModes, ASTC_formats, BCn_formats
-
-        texture = self.textures[index]
-        if texture.format_ in formats and texture.dim == 2 and texture.arrayLength < 2 and texture.tileMode in tileModes:
-            if texture.format_ == 0x101:
-                format_ = "la4"
-
-            elif texture.format_ == 0x201:
-                format_ = "l8"
-
-            elif texture.format_ == 0x301:
-                format_ = "rgba4"
-
-            elif texture.format_ == 0x401:
-                format_ = "abgr4"
-
-            elif texture.format_ == 0x501:
-                format_ = "rgb5a1"
-
-            elif texture.format_ == 0x601:
-                format_ = "a1bgr5"
-
-            elif texture.format_ == 0x701:
-                format_ = "rgb565"
-
-            elif texture.format_ == 0x801:
-                format_ = "bgr565"
-
-            elif texture.format_ == 0x901:
-                format_ = "la8"
-
-            elif (texture.format_ >> 8) == 0xb:
-                format_ = "rgba8"
-
-            elif (texture.format_ >> 8) == 0xc:
-                format_ = "bgra8"
-
-            elif texture.format_ == 0xe01:
-                format_ = "bgr10a2"
-
-            elif (texture.format_ >> 8) == 0x1a:
-                format_ = "BC1"
-
-            elif (texture.format_ >> 8) == 0x1b:
-                format_ = "BC2"
-
-            elif (texture.format_ >> 8) == 0x1c:
-                format_ = "BC3"
-
-            elif texture.format_ == 0x1d01:
-                format_ = "BC4U"
-
-            elif texture.format_ == 0x1d02:
-                format_ = "BC4S"
-
-            elif texture.format_ == 0x1e01:
-                format_ = "BC5U"
-
-            elif texture.format_ == 0x1e02:
-                format_ = "BC5S"
-
-            elif texture.format_ == 0x1f05:
-                format_ = "BC6H_SF16"
+            yield mipLevel, width, height, size, mipOffset, max(0, texture.blockHeightLog2 - blockHeightShift)
 
-            elif texture.format_ == 0x1f0a:
-                format_ = "BC6H_UF16"
+    def rawData(self, texture, levels=None):
+        """
+        Deswizzles the given mip levels of a texture, all of them by default.
+        Returns the data of each level, in the order of levels, and the block size.
+        """
+        blkWidth, blkHeight, bpp = self.getBlockInfo(texture)
 
-            elif (texture.format_ >> 8) == 0x20:
-                format_ = "BC7"
+        if levels is None:
+            levels = range(len(texture.mipOffsets))
 
-            elif texture.format_ == 0x3b01:
-                format_ = "bgr5a1"
+        for mipLevel in levels:
+            if not 0 <= mipLevel < len(texture.mipOffsets):
+                raise ValueError("%s has no mip level %d" % (texture.name, mipLevel))
 
-            result_, blkWidth, blkHeight = self.rawData(texture)
-
-            if exportAs:
-                if (texture.format_ >> 8) in ASTC_formats:
-                    file = QtWidgets.QFileDialog.getSaveFileName(None, "Save File", "", "ASTC (*.astc)")[0]
-
-                else:
-                    file = QtWidgets.QFileDialog.getSaveFileName(None, "Save File", "", "DDS (*.dds)")[0]
+        target = 1 if self.target == "NX  " else 0
+        results = {}
 
-                if not file:
-                    return False
+        for mipLevel, width, height, size, mipOffset, blockHeightLog2 in self.mipLevels(texture):
+            if mipLevel not in levels:
+                continue
 
-            else:
-                name = texture.name.replace('\\', '_').replace('/', '_').replace(':', '_').replace('*', '_').replace(
-                    '?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
+            result = swizzle.deswizzle(
+                width, height, blkWidth, blkHeight, target, bpp, texture.tileMode,
+                blockHeightLog2, texture.data[mipOffset:],
+            )
 
-                if (texture.format_ >> 8) in ASTC_formats:
-                    file = os.path.join(BFRESPath, name + '.astc')
+            results[mipLevel] = result[:size]
 
-                else:
-                    file = os.path.join(BFRESPath, name + '.dds')
+        return [results[mipLevel] for mipLevel in levels], blkWidth, blkHeight
 
-            if (texture.format_ >> 8) in ASTC_formats:
-                outBuffer = b''.join([
-                    b'\x13\xAB\xA1\x5C', blkWidth.to_bytes(1, "little"),
-                    blkHeight.to_bytes(1, "little"), b'\1',
-                    texture.width.to_bytes(3, "little"),
-                    texture.height.to_bytes(3, "little"), b'\1\0\0',
-                    result_[0],
-                ])
+    def rawDataInto(self, texture, out, level=0):
+        """
+        Deswizzles a mip level of a texture into the writable
+        buffer out, returns the size of the deswizzled data
+        """
+        blkWidth, blkHeight, bpp = self.getBlockInfo(texture)
 
-                with open(file, "wb+") as output:
-                    output.write(outBuffer)
+        target = 1 if self.target == "NX  " else 0
 
-            else:
-                hdr = dds.generateHeader(
-                    texture.numMips, texture.width, texture.height, format_, texture.compSel,
-                    len(result_[0]), (texture.format_ >> 8) in BCn_formats,
+        for mipLevel, width, height, size, mipOffset, blockHeightLog2 in self.mipLevels(texture):
+            if mipLevel == level:
+                return swizzle.deswizzleInto(
+                    width, height, blkWidth, blkHeight, target, bpp, texture.tileMode,
+                    blockHeightLog2, memoryview(texture.data)[mipOffset:], out,
                 )
 
-                with open(file, "wb+") as output:
-                    output.write(b''.join([hdr, b''.join(result_)]))
-
-        elif not dontShowMsg:
-            msg = "Can't convert: " + texture.name
-
-            if texture.format_ not in formats:
-                context = "Unsupported format."
-
-            elif texture.tileMode not in tileModes:
-                context = "Unsupported tiling mode."
-
-            elif texture.dim != 2:
-                context = "Unsupported image storage dimension."
-
-            else:
-                context = "Unsupported array length."
-
-            QtWidgets.QMessageBox.warning(None, "Error", '\n'.join([msg, context]))
-            return False
+        raise ValueError("%s has no mip level %d" % (texture.name, level))
 
     @staticmethod
     def getCurrentMipOffset_Size(width, height, blkWidth, blkHeight, bpp, currLevel):
@@ -326,113 +270,6 @@ class File:
 
         return offset, size
 
-
-    def replace(self, texture, tileMode, SRGB, sparseBinding, sparseResidency, importMips, f):
-        global formats, blk_dims, bpps
-
-        width, height, format_, fourcc, dataSize, compSel, numMips, data = dds.readDDS(f, SRGB)
-
-        if 0 in [width, dataSize] and data == []:
-            QtWidgets.QMessageBox.warning(None, "Error", "Unsupported DDS file!")
-            return False
-
-        if format_ not in formats:
-            QtWidgets.QMessageBox.warning(None, "Error", "Unsupported DDS format!")
-            return False
-
-        if not importMips:
-            numMips = 1
-
-        else:
-            numMips = max(1, numMips + 1)
-
-        if tileMode == 1:
-            alignment = 1
-
-        else:
-            alignment = 512
-
-        if (format_ >> 8) in blk_dims:
-            blkWidth, blkHeight = blk_dims[format_ >> 8]
-
-        else:
-            blkWidth, blkHeight = 1, 1
-
-        bpp = bpps[format_ >> 8]
-
-        if tileMode == 1:
-            blockHeight = 1
-            blockHeightLog2 = 0
-
-            linesPerBlockHeight = 1
-
-        else:
-            blockHeight = swizzle.getBlockHeight(DIV_ROUND_UP(height, blkHeight))
-            blockHeightLog2 = len(bin(blockHeight)[2:]) - 1
-
-            linesPerBlockHeight = blockHeight * 8
-
-        result = []
-        surfSize = 0
-        mipOffsets = []
-        blockHeightShift = 0
-        target = 1 if self.target == "NX  " else 0
-
-        for mipLevel in range(numMips):
-            offset, size = self.getCurrentMipOffset_Size(width, height, blkWidth, blkHeight, bpp, mipLevel)
-            data_ = data[offset:offset + size]
-
-            width_ = max(1, width >> mipLevel)
-            height_ = max(1, height >> mipLevel)
-
-            width__ = DIV_ROUND_UP(width_, blkWidth)
-            height__ = DIV_ROUND_UP(height_, blkHeight)
-
-            dataAlignBytes = b'\0' * (round_up(surfSize, alignment) - surfSize)
-            surfSize += len(dataAlignBytes)
-            mipOffsets.append(surfSize)
-
-            if tileMode == 1:
-                pitch = width__ * bpp
-
-                if target == 1:
-                    pitch = round_up(width__ * bpp, 32)
-
-                surfSize += pitch * height__
-
-            else:
-                if pow2_round_up(height__) < linesPerBlockHeight:
-                    blockHeightShift += 1
-
-                pitch = round_up(width__ * bpp, 64)
-                surfSize += pitch * round_up(height__, max(1, blockHeight >> blockHeightShift) * 8)
-
-            result.append(bytearray(dataAlignBytes) + swizzle.swizzle(
-                width_, height_, blkWidth, blkHeight, target, bpp, tileMode,
-                max(0, blockHeightLog2 - blockHeightShift), data_,
-            ))
-
-        texture.readTexLayout = 1 if tileMode == 0 else 0
-        texture.sparseBinding = sparseBinding
-        texture.sparseResidency = sparseResidency
-        texture.dim = 2
-        texture.tileMode = tileMode
-        texture.numMips = numMips
-        texture.mipOffsets = mipOffsets
-        texture.width = width
-        texture.height = height
-        texture.format_ = format_
-        texture.accessFlags = 0x20
-        texture.arrayLength = 1
-        texture.blockHeightLog2 = blockHeightLog2
-        texture.imageSize = surfSize
-        texture.compSel = compSel
-        texture.alignment = alignment
-        texture.imgDim = 1
-        texture.data = b''.join(result)
-
-        return texture 
-
     def save(self):
         self.relocTblHeader.blockSize = 2
         self.relocTbl.blocks = [self.relocTbl.Block(self.header.endianness), self.relocTbl.Block(self.header.endianness)]
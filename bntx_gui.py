@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# bntx_gui.py
+# Extracting and replacing the textures of a BNTX file,
+# needs PyQt5 and the dds module of BNTX Editor
+
+
+################################################################
+################################################################
+
+import os.path
+from PyQt5 import QtWidgets
+
+import bntx as BNTX
+from bntx import (
+    ASTC_formats, BCn_formats, blk_dims, bpps, tileModes,
+    DIV_ROUND_UP, round_up, pow2_round_up,
+)
+
+
+# BNTX format: its name in dds.generateHeader()
+ddsFormats = {
+    0x0101: "la4",
+    0x0201: "l8",
+    0x0301: "rgba4",
+    0x0401: "abgr4",
+    0x0501: "rgb5a1",
+    0x0601: "a1bgr5",
+    0x0701: "rgb565",
+    0x0801: "bgr565",
+    0x0901: "la8",
+    0x0b01: "rgba8", 0x0b06: "rgba8",
+    0x0c01: "bgra8", 0x0c06: "bgra8",
+    0x0e01: "bgr10a2",
+    0x1a01: "BC1", 0x1a06: "BC1",
+    0x1b01: "BC2", 0x1b06: "BC2",
+    0x1c01: "BC3", 0x1c06: "BC3",
+    0x1d01: "BC4U",
+    0x1d02: "BC4S",
+    0x1e01: "BC5U",
+    0x1e02: "BC5S",
+    0x1f05: "BC6H_SF16",
+    0x1f0a: "BC6H_UF16",
+    0x2001: "BC7", 0x2006: "BC7",
+    0x3b01: "bgr5a1",
+}
+
+# Formats that can be extracted and replaced: the DDS ones
+# and every ASTC block size, as UNorm (1) and SRGB (6)
+formats = [*ddsFormats, *[(format_ << 8) | type_ for format_ in ASTC_formats for type_ in (1, 6)]]
+
+
+class File(BNTX.File):
+    def extract(self, index, BFRESPath, exportAs, dontShowMsg=False):
+        global formats, tileModes, ASTC_formats, BCn_formats
+
+        # BNTX Editor's dds module isn't part of this tree, only import it when it's used
+        import dds
+
+        texture = self.textures[index]
+        if texture.format_ in formats and texture.dim == 2 and texture.arrayLength < 2 and texture.tileMode in tileModes:
+            # None for ASTC, which is written to a .astc file instead of a DDS
+            format_ = ddsFormats.get(texture.format_)
+
+            result_, blkWidth, blkHeight = self.rawData(texture)
+
+            if exportAs:
+                if (texture.format_ >> 8) in ASTC_formats:
+                    file = QtWidgets.QFileDialog.getSaveFileName(None, "Save File", "", "ASTC (*.astc)")[0]
+
+                else:
+                    file = QtWidgets.QFileDialog.getSaveFileName(None, "Save File", "", "DDS (*.dds)")[0]
+
+                if not file:
+                    return False
+
+            else:
+                name = texture.name.replace('\\', '_').replace('/', '_').replace(':', '_').replace('*', '_').replace(
+                    '?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
+
+                if (texture.format_ >> 8) in ASTC_formats:
+                    file = os.path.join(BFRESPath, name + '.astc')
+
+                else:
+                    file = os.path.join(BFRESPath, name + '.dds')
+
+            if (texture.format_ >> 8) in ASTC_formats:
+                outBuffer = b''.join([
+                    b'\x13\xAB\xA1\x5C', blkWidth.to_bytes(1, "little"),
+                    blkHeight.to_bytes(1, "little"), b'\1',
+                    texture.width.to_bytes(3, "little"),
+                    texture.height.to_bytes(3, "little"), b'\1\0\0',
+                    result_[0],
+                ])
+
+                with open(file, "wb+") as output:
+                    output.write(outBuffer)
+
+            else:
+                hdr = dds.generateHeader(
+                    texture.numMips, texture.width, texture.height, format_, texture.compSel,
+                    len(result_[0]), (texture.format_ >> 8) in BCn_formats,
+                )
+
+                with open(file, "wb+") as output:
+                    output.write(b''.join([hdr, b''.join(result_)]))
+
+        elif not dontShowMsg:
+            msg = "Can't convert: " + texture.name
+
+            if texture.format_ not in formats:
+                context = "Unsupported format."
+
+            elif texture.tileMode not in tileModes:
+                context = "Unsupported tiling mode."
+
+            elif texture.dim != 2:
+                context = "Unsupported image storage dimension."
+
+            else:
+                context = "Unsupported array length."
+
+            QtWidgets.QMessageBox.warning(None, "Error", '\n'.join([msg, context]))
+            return False
+
+    def replace(self, texture, tileMode, SRGB, sparseBinding, sparseResidency, importMips, f):
+        global formats, blk_dims, bpps
+
+        import dds
+
+        width, height, format_, fourcc, dataSize, compSel, numMips, data = dds.readDDS(f, SRGB)
+
+        if 0 in [width, dataSize] and data == []:
+            QtWidgets.QMessageBox.warning(None, "Error", "Unsupported DDS file!")
+            return False
+
+        if format_ not in formats:
+            QtWidgets.QMessageBox.warning(None, "Error", "Unsupported DDS format!")
+            return False
+
+        if not importMips:
+            numMips = 1
+
+        else:
+            numMips = max(1, numMips + 1)
+
+        if tileMode == 1:
+            alignment = 1
+
+        else:
+            alignment = 512
+
+        if (format_ >> 8) in blk_dims:
+            blkWidth, blkHeight = blk_dims[format_ >> 8]
+
+        else:
+            blkWidth, blkHeight = 1, 1
+
+        bpp = bpps[format_ >> 8]
+
+        if tileMode == 1:
+            blockHeight = 1
+            blockHeightLog2 = 0
+
+            linesPerBlockHeight = 1
+
+        else:
+            blockHeight = BNTX.swizzle.getBlockHeight(DIV_ROUND_UP(height, blkHeight))
+            blockHeightLog2 = len(bin(blockHeight)[2:]) - 1
+
+            linesPerBlockHeight = blockHeight * 8
+
+        result = []
+        surfSize = 0
+        mipOffsets = []
+        blockHeightShift = 0
+        target = 1 if self.target == "NX  " else 0
+
+        for mipLevel in range(numMips):
+            offset, size = self.getCurrentMipOffset_Size(width, height, blkWidth, blkHeight, bpp, mipLevel)
+            data_ = data[offset:offset + size]
+
+            width_ = max(1, width >> mipLevel)
+            height_ = max(1, height >> mipLevel)
+
+            width__ = DIV_ROUND_UP(width_, blkWidth)
+            height__ = DIV_ROUND_UP(height_, blkHeight)
+
+            dataAlignBytes = b'\0' * (round_up(surfSize, alignment) - surfSize)
+            surfSize += len(dataAlignBytes)
+            mipOffsets.append(surfSize)
+
+            if tileMode == 1:
+                pitch = width__ * bpp
+
+                if target == 1:
+                    pitch = round_up(width__ * bpp, 32)
+
+                surfSize += pitch * height__
+
+            else:
+                if pow2_round_up(height__) < linesPerBlockHeight:
+                    blockHeightShift += 1
+
+                pitch = round_up(width__ * bpp, 64)
+                surfSize += pitch * round_up(height__, max(1, blockHeight >> blockHeightShift) * 8)
+
+            result.append(bytearray(dataAlignBytes) + BNTX.swizzle.swizzle(
+                width_, height_, blkWidth, blkHeight, target, bpp, tileMode,
+                max(0, blockHeightLog2 - blockHeightShift), data_,
+            ))
+
+        texture.readTexLayout = 1 if tileMode == 0 else 0
+        texture.sparseBinding = sparseBinding
+        texture.sparseResidency = sparseResidency
+        texture.dim = 2
+        texture.tileMode = tileMode
+        texture.numMips = numMips
+        texture.mipOffsets = mipOffsets
+        texture.width = width
+        texture.height = height
+        texture.format_ = format_
+        texture.accessFlags = 0x20
+        texture.arrayLength = 1
+        texture.blockHeightLog2 = blockHeightLog2
+        texture.imageSize = surfSize
+        texture.compSel = compSel
+        texture.alignment = alignment
+        texture.imgDim = 1
+        texture.data = b''.join(result)
+
+        return texture
@@ -185,7 +185,7 @@ class StringTable:
         def load(self, data, pos):
             self.pos = pos
             self.size_ = struct.unpack_from(self.format, data, pos)[0]
-            self.string = data[pos + 2:pos + 2 + self.size_].decode('utf-8')
+            self.string = str(data[pos + 2:pos + 2 + self.size_], 'utf-8')
 
         def save(self):
             return b''.join([
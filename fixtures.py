@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# fixtures.py
+# Generates structurally valid synthetic NSMBUDX levels and
+# tilesets, for benchmarking and testing without game data
+
+
+################################################################
+################################################################
+
+import argparse
+import os
+import random
+import struct
+
+import bcn
+import bntx as BNTX
+import sarc
+
+
+def yaz0Literal(data):
+    """
+    Yaz0 "compresses" data storing every byte as a literal,
+    which any Yaz0 decoder accepts and takes no time at all
+    """
+    groups = (len(data) + 7) // 8
+    padded = bytes(data) + bytes(groups * 8 - len(data))
+
+    out = bytearray(groups * 9)
+    out[0::9] = b'\xFF' * groups
+    for i in range(8):
+        out[i + 1::9] = padded[i::8]
+
+    return b'Yaz0' + struct.pack('>I', len(data)) + bytes(8) + bytes(out)
+
+
+def makeImage(width, height, seed=0):
+    """
+    Returns RGBA8 pixels with a bit of structure, so they
+    compress like real textures rather than random noise
+    """
+    r = random.Random(seed)
+    tile = bytes(r.randrange(256) for _ in range(64 * 4))
+    row = (tile * (width // 64 + 1))[:width * 4]
+
+    return b''.join(row[y % 7 * 4:] + row[:y % 7 * 4] for y in range(height))
+
+
+# BNTX formats of the textures makeTileset() can make
+textureFormats = {
+    'rgba8': 0xb01,
+    'bc1': 0x1a01,
+    'bc1_srgb': 0x1a06,
+    'bc2': 0x1b01,
+    'bc3': 0x1c01,
+    'bc3_srgb': 0x1c06,
+    'bc4': 0x1d01,
+    'bc5': 0x1e01,
+}
+
+
+def makeTextureData(width, height, format_, seed=0):
+    """
+    Returns the data of a texture in a BNTX format. BC1 and BC3 are
+    encoded from makeImage(), the other BCn formats are random blocks.
+    """
+    if format_ >> 8 == 0xb:
+        return makeImage(width, height, seed)
+
+    elif format_ >> 8 == 0x1a:
+        return bcn.encode(makeImage(width, height, seed), width, height, bcn.BC1_FORMAT)
+
+    elif format_ >> 8 == 0x1c:
+        return bcn.encode(makeImage(width, height, seed), width, height, bcn.BC3_FORMAT)
+
+    blkWidth, blkHeight = BNTX.blk_dims[format_ >> 8]
+    size = BNTX.DIV_ROUND_UP(width, blkWidth) * BNTX.DIV_ROUND_UP(height, blkHeight) * BNTX.bpps[format_ >> 8]
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, 'little')
+
+
+def swizzleTexture(width, height, levels, format_=0xb01):
+    """
+    Swizzles the mip levels of a texture the way NSMBUDX stores them
+    (block linear), returns the data, the offset of every level and
+    the blockHeightLog2 of the texture
+    """
+    blkWidth, blkHeight = BNTX.blk_dims.get(format_ >> 8, (1, 1))
+    bpp = BNTX.bpps[format_ >> 8]
+
+    blockHeight = BNTX.swizzle.getBlockHeight(BNTX.DIV_ROUND_UP(height, blkHeight))
+    blockHeightLog2 = len(bin(blockHeight)[2:]) - 1
+
+    data = bytearray()
+    mipOffsets = []
+    blockHeightShift = 0
+    for mipLevel, level in enumerate(levels):
+        width_ = max(1, width >> mipLevel)
+        height_ = max(1, height >> mipLevel)
+
+        # Small levels use smaller blocks, like BNTX.File.mipLevels() expects
+        if BNTX.pow2_round_up(BNTX.DIV_ROUND_UP(height_, blkHeight)) < blockHeight * 8:
+            blockHeightShift += 1
+
+        data += bytes(sarc.round_up(len(data), 0x200) - len(data))
+        mipOffsets.append(len(data))
+        data += BNTX.swizzle.swizzle(width_, height_, blkWidth, blkHeight, 1, bpp, 0,
+                                     max(0, blockHeightLog2 - blockHeightShift), level)
+
+    return bytes(data), mipOffsets, blockHeightLog2
+
+
+def makeBNTX(textures, name='textures'):
+    """
+    Builds a little endian Switch BNTX from (name, width, height, data)
+    tuples, data being RGBA8 pixels, or (name, width, height, data, format)
+    ones for other formats. data can also be a list of the data of every
+    mip level. Every texture is block linear.
+    """
+    infoStruct = struct.Struct('<2B4H2x2I3i3I20x3IB3x8q')
+    count = len(textures)
+
+    swizzled = []
+    for texName, width, height, levels, *format_ in textures:
+        if not isinstance(levels, list):
+            levels = [levels]
+
+        format_ = format_[0] if format_ else 0xb01
+        swizzled.append((texName, width, height, len(levels), format_, *swizzleTexture(width, height, levels, format_)))
+
+    # String table: the file name, then the texture names
+    strPos = 0x58 + 8 * count
+    strings = [name] + [texture[0] for texture in textures]
+    strTbl = bytearray(struct.pack('<I4x', len(strings)))
+    stringPos = []
+    for string in strings:
+        stringPos.append(strPos + 16 + len(strTbl))
+        strTbl += struct.pack('<H', len(string)) + string.encode('utf-8') + b'\0'
+        strTbl += b'\0' * (len(strTbl) % 2)
+
+    # Texture name dictionary, the root entry first
+    dictPos = sarc.round_up(strPos + 16 + len(strTbl), 8)
+    texDict = bytearray(struct.pack('<4sI', b'_DIC', count))
+    texDict += struct.pack('<I2Hq', 0xFFFFFFFF, 1, 0, stringPos[0])
+    for i in range(count):
+        texDict += struct.pack('<I2Hq', 0, i, i + 1, stringPos[i + 1])
+
+    strBody = bytes(strTbl) + bytes(dictPos - strPos - 16 - len(strTbl)) + bytes(texDict)
+    strBlock = struct.pack('<4s2I4x', b'_STR', 16 + len(strBody), 16 + len(strBody)) + strBody
+
+    # Texture infos, followed by the pointers to their mip levels
+    infoPos = strPos + len(strBlock)
+    infoSizes = [16 + infoStruct.size + 8 * texture[3] for texture in swizzled]
+    dataPos = sarc.round_up(infoPos + sum(infoSizes) + 16, 0x1000)
+
+    infos = bytearray()
+    data = bytearray()
+    infoPtrs = []
+    for i, (texName, width, height, numMips, format_, texData, mipOffsets, blockHeightLog2) in enumerate(swizzled):
+        offset = dataPos + len(data)
+        data += texData
+        data += bytes(sarc.round_up(len(data), 0x200) - len(data))
+
+        pos = infoPos + len(infos)
+        infoPtrs.append(pos)
+        infos += struct.pack('<4s2I4x', b'BRTI', infoSizes[i], infoSizes[i])
+        infos += infoStruct.pack(
+            1, 2, 0, 0, numMips, 1, format_, 0x20, width, height, 1, 1, blockHeightLog2, 0x10000,
+            len(texData), 0x200, 0x05040302, 1, stringPos[i + 1], 0x20, pos + 16 + infoStruct.size,
+            0, 0, 0, 0, 0,
+        )
+        infos += b''.join(struct.pack('<q', offset + mipOffset) for mipOffset in mipOffsets)
+
+    relocPos = dataPos + len(data)
+
+    header = struct.pack('<8sIH2BI2H2I', b'BNTX\0\0\0\0', 0x40000, 0xFEFF, 0xC, 0x40, stringPos[0] + 2, 0,
+                         strPos, relocPos, relocPos + 16)
+    container = struct.pack('<4sI5qI4x', b'NX  ', count, 0x58, dataPos - 16, dictPos, 0x58, 0, 0)
+
+    out = bytearray(header + container)
+    for pos in infoPtrs:
+        out += struct.pack('<q', pos)
+
+    out += strBlock
+    out += infos
+    out += bytes(dataPos - 16 - len(out))
+    out += struct.pack('<4s2I4x', b'BRTD', 0, 16 + len(data))
+    out += data
+
+    # An empty relocation table
+    out += struct.pack('<4s2I4x', b'_RLT', relocPos, 0)
+
+    return bytes(out)
+
+
+def makeBFRES(files):
+    """
+    Builds a little endian Switch BFRES holding nothing
+    but the given (name, data) external files
+    """
+    count = len(files)
+
+    namesPos = 0xD0
+    names = bytearray()
+    namePos = []
+    for name, _ in files:
+        namePos.append(namesPos + len(names))
+        names += struct.pack('<H', len(name)) + name.encode('utf-8') + b'\0'
+        names += b'\0' * (len(names) % 2)
+
+    dictPos = sarc.round_up(namesPos + len(names), 8)
+    fileDict = bytearray(struct.pack('<4sI', b'_DIC', count))
+    fileDict += struct.pack('<I2Hq', 0xFFFFFFFF, 1, 0, 0)
+    for i in range(count):
+        fileDict += struct.pack('<I2Hq', 0, i, i + 1, namePos[i])
+
+    tablePos = sarc.round_up(dictPos + len(fileDict), 8)
+    dataPos = sarc.round_up(tablePos + 16 * count, 0x1000)
+
+    table = bytearray()
+    data = bytearray()
+    for _, fileData in files:
+        table += struct.pack('<2q', dataPos + len(data), len(fileData))
+        data += fileData
+        data += bytes(sarc.round_up(len(data), 0x1000) - len(data))
+
+    header = bytearray(0xD0)
+    struct.pack_into('<8sIH', header, 0, b'FRES    ', 0x00050003, 0xFEFF)
+    struct.pack_into('<q', header, 0x98, tablePos)
+    struct.pack_into('<q', header, 0xA0, dictPos)
+    struct.pack_into('<q', header, 0xC8, count)
+
+    out = header + names + bytes(dictPos - namesPos - len(names)) + fileDict
+    out += bytes(tablePos - len(out)) + table
+    out += bytes(dataPos - len(out)) + data
+
+    return bytes(out)
+
+
+def makeObjectDefs(count, seed=0):
+    """
+    Returns the BG_unt definitions file and its
+    little endian index (_hd.bin) for count objects
+    """
+    r = random.Random(seed)
+
+    deffile = bytearray()
+    indexfile = bytearray()
+    for _ in range(count):
+        width = r.randint(1, 4)
+        height = r.randint(1, 4)
+        indexfile += struct.pack('<HBBH', len(deffile), width, height, r.choice((0, 0, 0x10, 0x20)))
+
+        for _ in range(height):
+            if r.random() < 0.1:
+                deffile.append(r.choice((0x80, 0x81, 0x84, 0x85)))  # Slope control byte
+
+            for _ in range(width):
+                deffile += bytes((r.choice((0, 1, 2)), r.randrange(256), r.randrange(64) << 2 | r.randrange(4)))
+
+            deffile.append(0xFE)
+
+        deffile.append(0xFF)
+
+    return bytes(deffile), bytes(indexfile)
+
+
+def makeTileset(name, width=2048, height=512, objects=128, anims=False, seed=0, textureFormat='rgba8', mips=1):
+    """
+    Returns the Yaz0 compressed SARC of a synthetic NSMBUDX tileset,
+    as found in the "Unit" folder, its textures being in one of
+    textureFormats and having that many mip levels
+    """
+    format_ = textureFormats[textureFormat]
+
+    def texture(texName, width, height, seed):
+        levels = [makeTextureData(max(1, width >> level), max(1, height >> level), format_, seed + level * 16)
+                  for level in range(mips)]
+
+        return texName, width, height, levels, format_
+
+    textures = [
+        texture(name, width, height, seed),
+        texture(name + '_nml', width, height, seed + 1),
+    ]
+
+    if anims:
+        for i, anim in enumerate(('hatena_anime', 'block_anime', 'hatena_anime_L', 'block_anime_L',
+                                  'tuka_coin_anime', 'belt_conveyor_anime')):
+            textures.append(texture(anim, 64, 512, seed + i + 2))
+
+    deffile, indexfile = makeObjectDefs(objects, seed)
+    colldata = random.Random(seed).getrandbits(8 * 0x2000).to_bytes(0x2000, 'little')
+
+    arc = sarc.Writer('<')
+    arc.addFile('output.bfres', makeBFRES([('textures.bntx', makeBNTX(textures))]))
+    arc.addFile('BG_chk/d_bgchk_%s.bin' % name, colldata)
+    arc.addFile('BG_unt/%s.bin' % name, deffile)
+    arc.addFile('BG_unt/%s_hd.bin' % name, indexfile)
+
+    return yaz0Literal(arc.save())
+
+
+def makeCourse(tilesets=('', '', '', ''), sprites=200, objects=500, zones=12, paths=20, nodes=30,
+               locations=10, entrances=8, metadata=True, seed=0):
+    """
+    Returns the little endian course file and object layers
+    (course, L0, L1, L2) of a synthetic area
+    """
+    r = random.Random(seed)
+    blocks = [b''] * 15
+
+    # Block 1: tileset names
+    blocks[0] = b''.join(name.encode('utf-8').ljust(32, b'\0') for name in tilesets)
+
+    # Block 2: options
+    blocks[1] = struct.pack('<IIHHxBBBBxxBHH', 1, 2, 9, 300, 100, 0, 100, 3, 1, 200, 0)
+
+    # Blocks 3 and 5: zone boundings and backgrounds
+    boundings = 5
+    backgrounds = 4
+    blocks[2] = b''.join(struct.pack('<llllHHxxxxxxxx', r.randint(-50, 50), r.randint(-50, 50), 0, 0, i, r.randint(0, 2))
+                         for i in range(boundings))
+    blocks[4] = b''.join(struct.pack('<HHHH16sxBxx', i, r.randint(0, 3), 0, 1, b'Nohara', r.randint(0, 1))
+                         for i in range(backgrounds))
+
+    # Blocks 4 and 6 aren't parsed
+    blocks[3] = bytes(r.randrange(256) for _ in range(40))
+    blocks[5] = bytes(r.randrange(256) for _ in range(24))
+
+    # Block 7: entrances
+    blocks[6] = b''.join(struct.pack('<HHhhBBBBBBxBHBBBBBx', r.randrange(5000), r.randrange(1000), -5, 3, i,
+                                     0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+                         for i in range(entrances))
+
+    # Block 8: sprites, and block 9: loaded sprites
+    blocks[7] = b''.join(struct.pack('<HHHHIIBB2sBxxx', r.randrange(700), r.randrange(5000), r.randrange(1000),
+                                     r.randrange(65536), r.getrandbits(32), r.getrandbits(32), 0, 0, b'\0\0', 0)
+                         for _ in range(sprites)) + b'\xFF' * 4
+    blocks[8] = b'\0' * 8
+
+    # Block 10: zones
+    blocks[9] = b''.join(struct.pack('<HHHHHHBBBBxBBxBxBBxBxx', r.randrange(5000), r.randrange(1000), 400, 300, 0, 0,
+                                     i, r.randrange(boundings), 0, 0, 0, r.randrange(backgrounds), 0, 1, 0, 0)
+                         for i in range(zones))
+
+    # Block 11: locations
+    blocks[10] = b''.join(struct.pack('<HHHHBxxx', r.randrange(5000), r.randrange(1000), 16, 16, i)
+                          for i in range(locations))
+
+    # Blocks 14 and 15: paths and their nodes
+    pathData = []
+    nodeData = []
+    for i in range(paths):
+        count = r.randint(0, nodes)
+        pathData.append(struct.pack('<BbHHHxxxx', i, 0, len(nodeData), count, r.choice((0, 2))))
+        for _ in range(count):
+            nodeData.append(struct.pack('<HHffhHBBBx', r.randrange(5000), r.randrange(1000),
+                                        r.random() * 4, r.random(), 0, r.randrange(9), 0, 0, 0))
+
+    blocks[13] = b''.join(pathData)
+    blocks[14] = b''.join(nodeData)
+
+    # Metadata, between the block headers and the first block
+    md = b''
+    if metadata:
+        md = b'MD2_' + struct.pack('>I', 6) + b'Author' + struct.pack('>I', 1) + struct.pack('>II', 1, 8) + b'fixtures'
+        md += b'\0' * (-len(md) % 4)
+
+    head = bytearray(0x78)
+    pos = 0x78 + len(md)
+    for i, block in enumerate(blocks):
+        struct.pack_into('<II', head, i * 8, pos if block else 0, len(block))
+        pos += len(block)
+
+    course = bytes(head) + md + b''.join(blocks)
+
+    # Object layers, using the first 32 objects of the tilesets that are there
+    slots = [i for i, name in enumerate(tilesets) if name]
+    layers = []
+    for count in (objects, objects // 4, objects // 8):
+        layer = bytearray()
+        for _ in range(count):
+            type = r.choice(slots) << 12 | r.randrange(32) if slots else 0
+            layer += struct.pack('<HhhHHBxxxxx', type, r.randrange(500), r.randrange(200),
+                                 r.randint(1, 8), r.randint(1, 8), 0)
+
+        layers.append(bytes(layer) + b'\xFF\xFF' if count else None)
+
+    return (course, *layers)
+
+
+def makeLevel(areas):
+    """
+    Returns a little endian level SARC from the (course, L0, L1, L2) of every area
+    """
+    arc = sarc.Writer('<')
+    for areanum, files in enumerate(areas, 1):
+        course, L0, L1, L2 = files
+        arc.addFile('course/course%d.bin' % areanum, course)
+
+        for layer, data in enumerate((L0, L1, L2)):
+            if data is not None:
+                arc.addFile('course/course%d_bgdatL%d.bin' % (areanum, layer), data)
+
+    return arc.save()
+
+
+def makeRomfs(outDir, levels=4, areas=2, tilesets=3, tilesetSize=(2048, 512), objects=128, sprites=200,
+              layerObjects=500, zones=12, paths=20, seed=0, textureFormat='rgba8', textureMips=1):
+    """
+    Writes a romfs-like "Course" and "Unit" folder to outDir.
+    Every level uses the shared Pa0_jyotyu and one of the other tilesets.
+    """
+    courseDir = os.path.join(outDir, 'Course')
+    unitDir = os.path.join(outDir, 'Unit')
+    os.makedirs(courseDir, exist_ok=True)
+    os.makedirs(unitDir, exist_ok=True)
+
+    names = ['Pa0_jyotyu'] + ['Pa1_fixture%d' % i for i in range(tilesets - 1)]
+    for i, name in enumerate(names):
+        with open(os.path.join(unitDir, name + '.szs'), 'wb') as out:
+            out.write(makeTileset(name, *tilesetSize, objects, name.startswith('Pa0'), seed + i,
+                                  textureFormat, textureMips))
+
+    for i in range(levels):
+        slots = (names[0], names[1 + i % (len(names) - 1)] if len(names) > 1 else '', '', '')
+        level = makeLevel([makeCourse(slots, sprites, layerObjects, zones, paths, seed=seed + i * 16 + j)
+                           for j in range(areas)])
+
+        with open(os.path.join(courseDir, '%d-%d.sarc' % (i // 4 + 1, i % 4 + 1)), 'wb') as out:
+            out.write(level)
+
+
+def parseSize(size):
+    width, height = size.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic NSMBUDX romfs for benchmarks and tests.')
+    parser.add_argument('output', help='the folder to write "Course" and "Unit" to')
+    parser.add_argument('--levels', type=int, default=4)
+    parser.add_argument('--areas', type=int, default=2, help='areas per level')
+    parser.add_argument('--tilesets', type=int, default=3)
+    parser.add_argument('--tileset-size', type=parseSize, default=(2048, 512), metavar='WxH')
+    parser.add_argument('--objects', type=int, default=128, help='object definitions per tileset')
+    parser.add_argument('--sprites', type=int, default=200, help='sprites per area')
+    parser.add_argument('--layer-objects', type=int, default=500, help='objects in layer 1 of every area')
+    parser.add_argument('--zones', type=int, default=12, help='zones per area')
+    parser.add_argument('--paths', type=int, default=20, help='paths per area')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--texture-format', default='rgba8', choices=list(textureFormats),
+                        help='format of the tileset textures')
+    parser.add_argument('--texture-mips', type=int, default=1, help='mip levels of the tileset textures')
+    args = parser.parse_args()
+
+    makeRomfs(args.output, args.levels, args.areas, args.tilesets, args.tileset_size, args.objects, args.sprites,
+              args.layer_objects, args.zones, args.paths, args.seed, args.texture_format, args.texture_mips)
+
+
+if __name__ == '__main__':
+    main()
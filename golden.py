@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# golden.py
+# Converts levels with the pure Python reference code and with every
+# accelerated variant, and checks that the outputs are byte identical
+
+
+################################################################
+################################################################
+
+import argparse
+import sys
+import tempfile
+
+import addrlib
+import fixtures
+import gtx
+import sarc
+from benchmark import loadRomfs
+from NSMBU import Game
+from perfgate import setBackend
+from tileset import DecompYaz0, GetTextureOptions, SetTextureOptions
+
+
+REFERENCE = 'python'
+
+# The texture options the variants start from
+DEFAULT_TEXTURE_OPTIONS = GetTextureOptions()
+
+# name: (backend, workers, texture options), the reference
+# converting with the same texture options as each variant
+VARIANTS = {
+    'cython': ('cython', 1, {}),
+    'parallel': ('cython', 2, {}),
+    'mips': ('cython', 1, {'mips': 3}),
+    'bc1': ('cython', 1, {'compression': 'bc1', 'mips': 3}),
+    'bc3': ('cython', 1, {'compression': 'bc3', 'mips': 3, 'encodeWorkers': 2}),
+    'parallel.bc': ('cython', 2, {'compression': 'bc', 'mips': 3}),
+}
+
+
+def firstDifference(a, b):
+    """
+    Returns the offset of the first byte that differs
+    between a and b, None if they are identical
+    """
+    if a == b:
+        return None
+
+    # Narrow it down in chunks first, comparing bytes one by one is slow
+    size = min(len(a), len(b))
+    start = 0
+    chunk = 0x1000
+    while start < size and a[start:start + chunk] == b[start:start + chunk]:
+        start += chunk
+
+    end = min(start + chunk, size)
+    for offset in range(start, end):
+        if a[offset] != b[offset]:
+            return offset
+
+    return size
+
+
+def difference(path, offset, message):
+    return {'path': path, 'offset': offset, 'message': message}
+
+
+def compareGTX(path, ref, out):
+    """
+    Compares the surfaces of two GTX files, then the pixels
+    of their images decoded with addrlib.deswizzle
+    """
+    refSurfaces = gtx.readGFD(ref)
+    outSurfaces = gtx.readGFD(out)
+    if len(refSurfaces) != len(outSurfaces):
+        return [difference(path, None, "%d surfaces instead of %d" % (len(outSurfaces), len(refSurfaces)))]
+
+    differences = []
+    for i, ((refSurface, refImage, refMips), (outSurface, outImage, outMips)) in enumerate(zip(refSurfaces, outSurfaces)):
+        surfacePath = '%s[%d]' % (path, i)
+
+        fields = [name for name in ('dim', 'width', 'height', 'depth', 'numMips', 'format_', 'aa', 'use', 'imageSize',
+                                    'mipSize', 'tileMode', 'swizzle', 'alignment', 'pitch')
+                  if getattr(refSurface, name) != getattr(outSurface, name)]
+        if fields:
+            differences.append(difference(surfacePath, None, "surface fields differ: %s" % ', '.join(fields)))
+            continue
+
+        if refMips != outMips:
+            differences.append(difference(surfacePath + '.mips', firstDifference(refMips, outMips), "mip data differs"))
+
+        if refImage == outImage:
+            continue
+
+        s = refSurface
+        bpp = addrlib.surfaceGetBitsPerPixel(s.format_)
+        refPixels = addrlib.deswizzle(s.width, s.height, 1, s.format_, s.aa, s.use, s.tileMode, s.swizzle,
+                                      s.pitch, bpp, 0, 0, refImage)
+        outPixels = addrlib.deswizzle(s.width, s.height, 1, s.format_, s.aa, s.use, s.tileMode, s.swizzle,
+                                      s.pitch, bpp, 0, 0, outImage)
+
+        offset = firstDifference(refPixels, outPixels)
+        if offset is None:
+            differences.append(difference(surfacePath + '.image', firstDifference(refImage, outImage),
+                                          "swizzled data differs, decoded pixels are identical"))
+
+        else:
+            # Position of the pixel (or 4x4 block of compressed formats) in elements
+            width = (s.width + 3) // 4 if gtx.isBlockCompressed(s.format_) else s.width
+            element = offset // (bpp // 8)
+            differences.append(difference(surfacePath + '.pixels', offset, "decoded pixels differ at %d, %d"
+                                          % (element % width, element // width)))
+
+    return differences
+
+
+def compareArchives(path, ref, out):
+    """
+    Compares two SARC archives member by member, looking into nested
+    archives and GTX files. Returns a list of differences.
+    """
+    if ref == out:
+        return []
+
+    refArc = sarc.Reader(ref)
+    outArc = sarc.Reader(out)
+
+    refNames = set(refArc.names())
+    outNames = set(outArc.names())
+
+    differences = [difference('%s/%s' % (path, name), None, "missing") for name in sorted(refNames - outNames)]
+    differences += [difference('%s/%s' % (path, name), None, "unexpected") for name in sorted(outNames - refNames)]
+
+    for name in sorted(refNames & outNames):
+        differences += compareMember('%s/%s' % (path, name), bytes(refArc[name]), bytes(outArc[name]))
+
+    if not differences:
+        differences.append(difference(path, firstDifference(ref, out), "members are identical, the archive layout differs"))
+
+    return differences
+
+
+def compareMember(path, ref, out):
+    if ref == out:
+        return []
+
+    offset = firstDifference(ref, out)
+    if len(ref) != len(out):
+        message = "size is %d instead of %d" % (len(out), len(ref))
+
+    else:
+        message = "data differs"
+
+    try:
+        if ref[:4] == out[:4] == b'Yaz0':
+            return compareMember(path, DecompYaz0(ref), DecompYaz0(out))
+
+        elif ref[:4] == out[:4] == b'SARC':
+            return compareArchives(path, ref, out)
+
+        elif ref[:4] == out[:4] == b'Gfx2':
+            return compareGTX(path, ref, out) or [difference(path, offset, "headers differ")]
+
+    except ValueError as e:
+        message += " (%s)" % e
+
+    return [difference(path, offset, message)]
+
+
+def convertLevel(name, data, workers):
+    level = Game.Level(name)
+    if not level.load(data, workers):
+        raise RuntimeError("%s has no course folder!" % name)
+
+    return level.save(workers)
+
+
+def runVariant(levels, backend, workers, textureOptions):
+    """
+    Converts the levels with the given backend and texture options,
+    returns {name: converted level or the error}
+    """
+    if not setBackend(backend):
+        raise RuntimeError("The %s backend isn't available" % backend)
+
+    SetTextureOptions(**dict(DEFAULT_TEXTURE_OPTIONS, **textureOptions))
+
+    outputs = {}
+    for name, data in levels:
+        try:
+            outputs[name] = convertLevel(name, data, workers)
+
+        except Exception as e:
+            outputs[name] = e
+
+    return outputs
+
+
+def checkVariants(levels, variants):
+    """
+    Converts the levels with the reference code and every variant,
+    returns {variant: {level: differences}} of the levels that differ
+    """
+    # The reference outputs per texture options, leaving out
+    # encodeWorkers as it doesn't change the output
+    references = {}
+
+    results = {}
+    for variant in variants:
+        backend, workers, textureOptions = VARIANTS[variant]
+
+        referenceOptions = dict(textureOptions)
+        referenceOptions.pop('encodeWorkers', None)
+        key = tuple(sorted(referenceOptions.items()))
+        if key not in references:
+            print("Converting with the %s reference%s..." % (REFERENCE, describeOptions(referenceOptions)))
+            references[key] = runVariant(levels, REFERENCE, 1, referenceOptions)
+
+        reference = references[key]
+
+        print("Converting with %s..." % variant)
+        try:
+            outputs = runVariant(levels, backend, workers, textureOptions)
+
+        except RuntimeError as e:
+            print("Skipping %s: %s" % (variant, e))
+            continue
+
+        # Decode the textures with the reference code only
+        setBackend(REFERENCE)
+
+        results[variant] = {}
+        for name, _ in levels:
+            ref = reference[name]
+            out = outputs[name]
+
+            if isinstance(ref, Exception) or isinstance(out, Exception):
+                if type(ref) is not type(out) or str(ref) != str(out):
+                    results[variant][name] = [difference(name, None, "reference: %s, %s: %s"
+                                                         % (describeOutput(ref), variant, describeOutput(out)))]
+
+            else:
+                differences = compareArchives(name, ref, out)
+                if differences:
+                    results[variant][name] = differences
+
+    return results
+
+
+def describeOutput(output):
+    return repr(output) if isinstance(output, Exception) else 'converted'
+
+
+def describeOptions(textureOptions):
+    if not textureOptions:
+        return ''
+
+    return ' (%s)' % ', '.join('%s=%s' % item for item in sorted(textureOptions.items()))
+
+
+def printResults(results, count):
+    for variant, levels in results.items():
+        if not levels:
+            print("%s: all %d levels are identical to the reference" % (variant, count))
+            continue
+
+        print("%s: %d of %d levels differ from the reference" % (variant, len(levels), count))
+        for differences in levels.values():
+            for diff in differences:
+                where = '' if diff['offset'] is None else ' at 0x%x' % diff['offset']
+                print("    %s%s: %s" % (diff['path'], where, diff['message']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the accelerated code converts levels exactly like the reference code.')
+    parser.add_argument('--romfs', help='a romfs folder with "Course" and "Unit" (default: synthetic fixtures)')
+    parser.add_argument('--levels', type=int, default=3, help='number of levels to take from the romfs')
+    parser.add_argument('--variants', nargs='+', default=list(VARIANTS), choices=list(VARIANTS))
+    args = parser.parse_args()
+
+    tmpDir = None
+    romfs = args.romfs
+    if not romfs:
+        # The reference code is slow, keep the textures small
+        tmpDir = tempfile.TemporaryDirectory()
+        romfs = tmpDir.name
+        fixtures.makeRomfs(romfs, levels=args.levels, tilesets=2, tilesetSize=(512, 256))
+
+    try:
+        levels, _ = loadRomfs(romfs, args.levels)
+        results = checkVariants(levels, args.variants)
+
+    finally:
+        SetTextureOptions(**DEFAULT_TEXTURE_OPTIONS)
+        if tmpDir is not None:
+            tmpDir.cleanup()
+
+    printResults(results, len(levels))
+    if any(results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 # gtx.py
-# A small script for creating RGBA8 GTX files.
+# A small script for creating RGBA8, BC1 and BC3 GTX files.
 
 
 ################################################################
@@ -11,6 +11,7 @@
 import struct
 
 import addrlib
+import bcn
 from bntx import round_up as roundUp
 from texRegisters import makeRegsBytearray
 
@@ -68,6 +69,41 @@ class GX2Surface(struct.Struct):
          self.pitch) = self.unpack_from(data, pos)
 
 
+def readGFD(data):
+    """
+    Returns the [GX2Surface, image data, mip data] of every surface of a GTX file
+    """
+    header = GFDHeader()
+    header.data(data, 0)
+    if header.magic != b'Gfx2':
+        raise ValueError("Invalid GTX header!")
+
+    blockHeader = GFDBlockHeader()
+    surfaces = []
+
+    pos = header.size_
+    while pos < len(data):
+        blockHeader.data(data, pos)
+        if blockHeader.magic != b'BLK{':
+            raise ValueError("Invalid GTX block header!")
+
+        pos += blockHeader.size_
+        if blockHeader.type_ == 1:
+            break
+
+        elif blockHeader.type_ == 0xb:
+            surface = GX2Surface()
+            surface.data(data, pos)
+            surfaces.append([surface, b'', b''])
+
+        elif blockHeader.type_ in (0xc, 0xd) and surfaces:
+            surfaces[-1][blockHeader.type_ - 0xb] = bytes(data[pos:pos + blockHeader.dataSize])
+
+        pos += blockHeader.dataSize
+
+    return surfaces
+
+
 def getAlignBlockSize(dataOffset, alignment):
     alignSize = roundUp(dataOffset, alignment) - dataOffset - 32
 
@@ -79,61 +115,237 @@ def getAlignBlockSize(dataOffset, alignment):
     return alignSize
 
 
-def writeGFD(data, width, height, compSel):
-    imageData = bytes(data)
+# Size of the surface block, its header included
+SURFACE_BLOCK_SIZE = 32 + 0x9c
 
-    surfOut = addrlib.getSurfaceInfo(0x1a, width, height, 1, 1, 4, 0, 0)
-    alignment = surfOut.baseAlign
-    imageSize = surfOut.surfSize
-    pitch = surfOut.pitch
+_blockHeader = GFDBlockHeader()
+_surface = GX2Surface()
 
-    imageData += b'\0' * (surfOut.surfSize - len(data))
-    result = addrlib.swizzle(
-        width, height, 1, 0x1a, 0, 1, surfOut.tileMode,
-        0, surfOut.pitch, surfOut.bpp, 0, 0, imageData,
-    )
 
-    s = 13 << 16
+def _spread(data):
+    """
+    Returns data as an integer with every byte in its own 16-bit lane
+    """
+    wide = bytearray(len(data) * 2)
+    wide[0::2] = data
 
-    block_head_struct = GFDBlockHeader()
-    gx2surf_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 0xb, 0x9c, 0, 0)
+    return int.from_bytes(wide, 'little')
 
-    gx2surf_struct = GX2Surface()
-    gx2surf = gx2surf_struct.pack(1, width, height, 1, 1, 0x1a, 0, 1, imageSize, 0, 0, 0, 4, s, alignment, pitch)
 
-    image_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 0xc, imageSize, 0, 0)
-    output = gx2surf_blk_head + gx2surf
-    output += b'\0' * 56
+def downsample(data, width, height):
+    """
+    Halves an RGBA8 image with a 2x2 box filter, returns the image and its
+    size. All channels are averaged at once, in the 16-bit lanes of big
+    integers, odd rows and columns being dropped.
+    """
+    newWidth = max(1, width // 2)
+    newHeight = max(1, height // 2)
+    stride = width * 4
+    rowSize = newWidth * 8 if width > 1 else 4
 
-    output += 1 .to_bytes(4, 'big')
-    output += b'\0' * 4
-    output += 1 .to_bytes(4, 'big')
+    rows = [bytes(data[y * stride:y * stride + rowSize]) for y in range(newHeight * 2 if height > 1 else 1)]
+    top = b''.join(rows[0::2])
+    bottom = b''.join(rows[1::2]) if height > 1 else top
+
+    # The left and right pixels of every 2x2 block
+    pixels = []
+    for half in (top, bottom):
+        half = memoryview(half).cast('I')
+        if width > 1:
+            pixels += [half[0::2].tobytes(), half[1::2].tobytes()]
+
+        else:
+            pixels += [half.tobytes()] * 2
+
+    count = newWidth * newHeight * 4
+    rounding = int.from_bytes(b'\x02\x00' * count, 'little')
+    mask = int.from_bytes(b'\xFF\x00' * count, 'little')
+
+    total = sum(_spread(part) for part in pixels) + rounding
+    result = ((total >> 2) & mask).to_bytes(count * 2, 'little')[0::2]
 
-    for value in compSel:
-        output += value.to_bytes(1, 'big')
+    return result, newWidth, newHeight
+
+
+class GFDLayout:
+    """
+    The surface info of every mip level of a texture and the
+    sizes and offsets of the blocks writeGFDInto() writes for it
+    """
+
+    def __init__(self, width, height, numMips=1, format_=0x1a):
+        # GX2 supports up to 13 levels, down to 1x1
+        numMips = max(1, min(numMips, 13, max(width, height).bit_length()))
+
+        self.format_ = format_
+        self.surfOut = addrlib.getSurfaceInfo(format_, width, height, 1, 1, 4, 0, 0)
+        self.imageSize = self.surfOut.surfSize
+        self.alignSize = getAlignBlockSize(SURFACE_BLOCK_SIZE + 64, self.surfOut.baseAlign)
+
+        # (surface info, offset in the mip data) of the levels after the first
+        self.mips = []
+        self.mipSize = 0
+        mipAlignment = 1
+        for level in range(1, numMips):
+            surfOut = addrlib.getSurfaceInfo(format_, width, height, 1, 1, 4, 0, level)
+            offset = roundUp(self.mipSize, surfOut.baseAlign)
+
+            self.mips.append((surfOut, offset))
+            self.mipSize = offset + surfOut.surfSize
+            mipAlignment = max(mipAlignment, surfOut.baseAlign)
+
+        self.numMips = numMips
+        self.size = SURFACE_BLOCK_SIZE + 32 + self.alignSize + 32 + self.imageSize
+
+        self.mipAlignSize = 0
+        if self.mips:
+            self.mipAlignSize = getAlignBlockSize(32 + self.size + 32, mipAlignment)
+            self.size += 32 + self.mipAlignSize + 32 + self.mipSize
+
+    def getMipOffsets(self):
+        """
+        Returns the mipOffset array of the surface, the first one being the
+        offset of level 1 from the image, the others from level 1
+        """
+        offsets = [0] * 13
+        for level, (surfOut, offset) in enumerate(self.mips, 1):
+            if level == 1:
+                offsets[0] = roundUp(self.imageSize, surfOut.baseAlign)
+
+            else:
+                offsets[level - 1] = offset
+
+        return offsets
+
+
+def isBlockCompressed(format_):
+    """
+    Returns True if a GX2 format is one of BC1 to BC5
+    """
+    return (format_ & 0x3F) in range(0x31, 0x36)
+
+
+def encodeImage(data, width, height, format_, workers=1):
+    """
+    Returns an RGBA8 image in the given format
+    """
+    if format_ == 0x1a:
+        return data
+
+    return bcn.encode(data, width, height, format_, workers)
+
+
+def writeGFDInto(buffer, pos, data, width, height, compSel, layout, workers=1, encoded=False):
+    """
+    Writes the surface, alignment, image and mip blocks of a texture
+    into buffer at pos, data being its RGBA8 pixels and layout its
+    GFDLayout. The mip levels are generated from the image and every
+    level is encoded to the format of the layout, BCn encoding running
+    in workers processes. If encoded is set, data is instead the list
+    of every level already in the format of the layout.
+    The buffer must be zero filled, every level is swizzled straight
+    into it. Returns the position after the blocks.
+    """
+    surfOut = layout.surfOut
+    imageSize = layout.imageSize
+    numMips = layout.numMips
+    format_ = layout.format_
+
+    _blockHeader.pack_into(buffer, pos, b"BLK{", 32, 1, 0, 0xb, 0x9c, 0, 0)
+    pos += 32
+
+    _surface.pack_into(buffer, pos, 1, width, height, 1, numMips, format_, 0, 1, imageSize,
+                       0, layout.mipSize, 0, 4, 13 << 16, surfOut.baseAlign, surfOut.pitch)
+    pos += 64
+
+    struct.pack_into('>13I', buffer, pos, *layout.getMipOffsets())
+    pos += 52
+
+    struct.pack_into('>4I4B', buffer, pos, 0, numMips, 0, 1, *compSel)
+    pos += 20
+
+    # The registers take the pitch in pixels, not in blocks
+    pitch = surfOut.pitch * 4 if isBlockCompressed(format_) else surfOut.pitch
+    regs = makeRegsBytearray(width, height, numMips, format_, 4, pitch, compSel)
+    buffer[pos:pos + len(regs)] = regs
+    pos += len(regs)
+
+    _blockHeader.pack_into(buffer, pos, b"BLK{", 32, 1, 0, 2, layout.alignSize, 0, 0)
+    pos += 32 + layout.alignSize
+
+    _blockHeader.pack_into(buffer, pos, b"BLK{", 32, 1, 0, 0xc, imageSize, 0, 0)
+    pos += 32
+
+    if encoded:
+        levels = iter(data)
+        image = next(levels)
+
+    else:
+        image = encodeImage(data, width, height, format_, workers)
+
+    addrlib.swizzleInto(
+        width, height, 1, format_, 0, 1, surfOut.tileMode,
+        0, surfOut.pitch, surfOut.bpp, 0, 0, image,
+        memoryview(buffer)[pos:pos + imageSize],
+    )
 
-    output += makeRegsBytearray(width, height, 1, 0x1a, 4, pitch, compSel)
+    pos += imageSize
+    if not layout.mips:
+        return pos
 
-    alignSize = getAlignBlockSize(len(output) + 64, alignment)
-    align_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 2, alignSize, 0, 0)
+    _blockHeader.pack_into(buffer, pos, b"BLK{", 32, 1, 0, 2, layout.mipAlignSize, 0, 0)
+    pos += 32 + layout.mipAlignSize
 
-    output += align_blk_head
-    output += b'\0' * alignSize
-    output += image_blk_head
-    output += result
+    _blockHeader.pack_into(buffer, pos, b"BLK{", 32, 1, 0, 0xd, layout.mipSize, 0, 0)
+    pos += 32
 
-    return output
+    mipWidth, mipHeight = width, height
+    for mipSurfOut, offset in layout.mips:
+        if encoded:
+            image = next(levels)
+            mipWidth = max(1, mipWidth // 2)
+            mipHeight = max(1, mipHeight // 2)
 
+        else:
+            data, mipWidth, mipHeight = downsample(data, mipWidth, mipHeight)
+            image = encodeImage(data, mipWidth, mipHeight, format_, workers)
 
-def fromData(data, width, height, compSel):
-    head_struct = GFDHeader()
-    head = head_struct.pack(b"Gfx2", 32, 7, 1, 2, 1, 0, 0)
+        # Small levels can use a different tile mode
+        addrlib.swizzleInto(
+            mipWidth, mipHeight, 1, format_, 0, 1, mipSurfOut.tileMode,
+            0, mipSurfOut.pitch, mipSurfOut.bpp, 0, 0, image,
+            memoryview(buffer)[pos + offset:pos + offset + mipSurfOut.surfSize],
+        )
 
-    outData = b''.join([head, writeGFD(data, width, height, compSel)])
+    return pos + layout.mipSize
 
-    block_head_struct = GFDBlockHeader()
-    eof_blk_head = block_head_struct.pack(b"BLK{", 32, 1, 0, 1, 0, 0, 0)
 
-    outData += eof_blk_head
+def writeGFD(data, width, height, compSel, numMips=1, format_=0x1a, workers=1, encoded=False):
+    """
+    Returns the surface, alignment, image and mip blocks of
+    a texture, see writeGFDInto() for the arguments
+    """
+    layout = GFDLayout(width, height, numMips, format_)
+    output = bytearray(layout.size)
+    writeGFDInto(output, 0, data, width, height, compSel, layout, workers, encoded)
+
+    return output
 
-    return outData
+
+def fromData(data, width, height, compSel, numMips=1, format_=0x1a, workers=1, encoded=False):
+    """
+    Returns a GTX file of a texture from its RGBA8 pixels, built in a
+    single buffer. If numMips > 1, that many mip levels are generated.
+    format_ is 0x1a (RGBA8), 0x31 (BC1) or 0x33 (BC3), BCn encoding
+    running in workers processes.
+    If encoded is set, data is the list of the numMips levels of the
+    texture, already in format_, which can be any GX2 format.
+    """
+    layout = GFDLayout(width, height, numMips, format_)
+    output = bytearray(32 + layout.size + 32)
+
+    GFDHeader().pack_into(output, 0, b"Gfx2", 32, 7, 1, 2, 1, 0, 0)
+    pos = writeGFDInto(output, 32, data, width, height, compSel, layout, workers, encoded)
+    _blockHeader.pack_into(output, pos, b"BLK{", 32, 1, 0, 1, 0, 0, 0)
+
+    return output
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# instrument.py
+# Per-stage timers and memory profiling for the conversion,
+# disabled by default
+
+
+################################################################
+################################################################
+
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+
+enabled = False
+
+# Also track the memory of every stage, much slower
+memory = False
+
+# Number of allocation sites kept per stage
+TOP_SITES = 10
+
+# stage: [count, seconds, bytes] of the level being converted
+current = {}
+
+# stage: [peak bytes, peak RSS, {allocation site: bytes}] of the level being converted
+currentMemory = {}
+
+# level: {'seconds': wall time, 'stages': stats}
+levels = {}
+
+_levelName = None
+_levelStart = 0
+
+# The memory stages being run, innermost last
+_stack = []
+_startedTracing = False
+
+
+def getRSS():
+    """
+    Returns the resident set size of the process in bytes, the peak
+    one if the current one can't be read, 0 if neither can be
+    """
+    try:
+        with open('/proc/self/statm') as inf:
+            return int(inf.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+
+    try:
+        import resource
+
+    except ImportError:
+        return 0
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class Stage:
+    """
+    Adds the time spent in a with block and the
+    number of bytes it processed to a stage
+    """
+    __slots__ = ('name', 'nbytes', 'start')
+
+    def __init__(self, name, nbytes):
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+
+        stats = current.get(self.name)
+        if stats is None:
+            current[self.name] = [1, elapsed, self.nbytes]
+
+        else:
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += self.nbytes
+
+
+class MemoryStage(Stage):
+    """
+    A stage that also records the peak memory allocated in it,
+    the RSS of the process around it and where its memory was
+    allocated. Nested stages are accounted to their parents too.
+    """
+    __slots__ = ('startTraced', 'peak', 'rss', 'snapshot')
+
+    def __enter__(self):
+        # The peak is reset for this stage, keep the one of the parent so far
+        if _stack:
+            parent = _stack[-1]
+            parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+
+        self.rss = getRSS()
+        self.snapshot = tracemalloc.take_snapshot()
+
+        tracemalloc.reset_peak()
+        self.startTraced = self.peak = tracemalloc.get_traced_memory()[0]
+        _stack.append(self)
+
+        return Stage.__enter__(self)
+
+    def __exit__(self, *exc):
+        Stage.__exit__(self, *exc)
+        _stack.pop()
+
+        peak = max(self.peak, tracemalloc.get_traced_memory()[1]) - self.startTraced
+        rss = max(self.rss, getRSS())
+
+        # What the stage allocated and still holds at its end
+        diff = tracemalloc.take_snapshot().filter_traces(_filters).compare_to(
+            self.snapshot.filter_traces(_filters), 'lineno')
+        self.snapshot = None
+
+        stats = currentMemory.get(self.name)
+        if stats is None:
+            stats = currentMemory[self.name] = [0, 0, {}]
+
+        stats[0] = max(stats[0], peak)
+        stats[1] = max(stats[1], rss)
+
+        sites = stats[2]
+        for stat in diff[:TOP_SITES]:
+            if stat.size_diff <= 0:
+                break
+
+            frame = stat.traceback[0]
+            site = '%s:%d' % (frame.filename, frame.lineno)
+            sites[site] = max(sites.get(site, 0), stat.size_diff)
+
+
+_filters = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+class NullStage:
+    """
+    Does nothing, used while instrumentation is disabled
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_nullStage = NullStage()
+
+
+def stage(name, nbytes=0):
+    """
+    Returns a context manager timing the named stage.
+    nbytes is the size of the data the stage works on.
+    """
+    if not enabled:
+        return _nullStage
+
+    if memory:
+        return MemoryStage(name, nbytes)
+
+    return Stage(name, nbytes)
+
+
+def timed(name):
+    """
+    Decorator timing every call of a function as the named stage
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(trackMemory=False):
+    """
+    Enables the instrumentation. If trackMemory is set, the memory
+    of the stages is traced as well with tracemalloc.
+    """
+    global enabled, memory, _startedTracing
+    enabled = True
+    memory = trackMemory
+
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _startedTracing = True
+
+
+def disable():
+    global enabled, memory, _startedTracing
+    enabled = False
+    memory = False
+
+    if _startedTracing:
+        tracemalloc.stop()
+        _startedTracing = False
+
+
+def reset():
+    global _levelName
+    current.clear()
+    currentMemory.clear()
+    levels.clear()
+    _levelName = None
+
+
+def beginLevel(name):
+    """
+    Starts collecting the stages of a level
+    """
+    global _levelName, _levelStart
+    if not enabled:
+        return
+
+    current.clear()
+    currentMemory.clear()
+    _levelName = name
+    _levelStart = time.perf_counter()
+
+
+def endLevel():
+    """
+    Stores the stages collected since beginLevel()
+    """
+    global _levelName
+    if not enabled or _levelName is None:
+        return
+
+    levels[_levelName] = {
+        'seconds': time.perf_counter() - _levelStart,
+        'stages': statsToDict(current, currentMemory),
+    }
+
+    if memory:
+        levels[_levelName]['rss'] = getRSS()
+
+    current.clear()
+    currentMemory.clear()
+    _levelName = None
+
+
+def topSites(sites):
+    """
+    Returns the TOP_SITES largest of {allocation site: bytes}
+    """
+    sites = sorted(sites.items(), key=lambda item: item[1], reverse=True)[:TOP_SITES]
+    return [{'site': site, 'bytes': nbytes} for site, nbytes in sites]
+
+
+def statsToDict(stats, memoryStats=None):
+    result = {name: {'count': count, 'seconds': seconds, 'bytes': nbytes}
+              for name, (count, seconds, nbytes) in stats.items()}
+
+    for name, (peak, rss, sites) in (memoryStats or {}).items():
+        result[name].update({'peak': peak, 'rss': rss, 'sites': topSites(sites)})
+
+    return result
+
+
+def aggregate():
+    """
+    Returns the stages summed over all levels,
+    with the largest memory use of any of them
+    """
+    total = {}
+    sites = {}
+    for level in levels.values():
+        for name, stats in level['stages'].items():
+            if name not in total:
+                total[name] = {'count': 0, 'seconds': 0.0, 'bytes': 0}
+
+            for key in ('count', 'seconds', 'bytes'):
+                total[name][key] += stats[key]
+
+            if 'peak' not in stats:
+                continue
+
+            for key in ('peak', 'rss'):
+                total[name][key] = max(total[name].get(key, 0), stats[key])
+
+            stageSites = sites.setdefault(name, {})
+            for site in stats['sites']:
+                stageSites[site['site']] = max(stageSites.get(site['site'], 0), site['bytes'])
+
+    for name, stageSites in sites.items():
+        total[name]['sites'] = topSites(stageSites)
+
+    return total
+
+
+def report():
+    """
+    Returns the per-level and aggregate report
+    """
+    return {
+        'levels': levels,
+        'total': {
+            'seconds': sum(level['seconds'] for level in levels.values()),
+            'stages': aggregate(),
+        },
+    }
+
+
+def writeReport(filename):
+    with open(filename, 'w', encoding='utf-8') as out:
+        json.dump(report(), out, indent=2, sort_keys=True)
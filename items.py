@@ -194,3 +194,35 @@ class EntranceItem:
 
     def __lt__(self, other):
         return self.entid < other.entid
+
+
+class PathItem:
+    __slots__ = ('id', 'unk1', 'nodes', 'loops')
+
+    def __init__(self, id, unk1, nodes, loops):
+        """
+        Creates a path with specific data
+        """
+        self.id = id
+        self.unk1 = unk1
+        self.nodes = nodes
+        self.loops = loops
+
+
+class PathNodeItem:
+    # Block 15 field order, used by the bulk path node encoder
+    __slots__ = ('x', 'y', 'speed', 'accel', 'delay', 'unk1', 'unk2', 'unk3', 'unk4')
+
+    def __init__(self, x, y, speed, accel, delay, unk1, unk2, unk3, unk4):
+        """
+        Creates a path node with specific data
+        """
+        self.x = x
+        self.y = y
+        self.speed = speed
+        self.accel = accel
+        self.delay = delay
+        self.unk1 = unk1
+        self.unk2 = unk2
+        self.unk3 = unk3
+        self.unk4 = unk4
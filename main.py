@@ -13,4 +13,4 @@ game = Game()
 game.LoadLevel(name)
 
 with open(game.level.name + "_out.sarc", "wb") as out:
-    out.write(game.level.save())
+    game.level.write(out)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# perfgate.py
+# Runs the benchmarks with every swizzle/addrlib/BCn backend and fails
+# if anything got significantly slower than the stored baseline
+#
+# perf_baseline.json is the checked-in reference, made with
+# "python perfgate.py --update-baseline" on the default suites.
+# Timings only compare on the same hardware: a CI runner that differs
+# from the machine the baseline was made on should first store its own
+# baseline from the target branch, then gate the change against it:
+#     git checkout <target> && python perfgate.py --update-baseline --baseline base.json
+#     git checkout <change> && python perfgate.py --baseline base.json
+
+
+################################################################
+################################################################
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import addrlib
+import bcn
+import bntx as BNTX
+from benchmark import runBenchmarks
+
+
+BACKENDS = ('python', 'cython')
+
+# The suites that are gated by default, cheap enough to run before every release
+DEFAULT_SUITES = ('swizzle', 'addrlib', 'gtx', 'bcn', 'tileset')
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'perf_baseline.json')
+
+
+def setBackend(name):
+    """
+    Switches swizzle, addrlib and the BCn encoder to the given
+    backend, returns False if it isn't available
+    """
+    try:
+        BNTX.setSwizzleBackend(name)
+        addrlib.setBackend(name)
+        bcn.setBackend(name)
+
+    except ImportError:
+        return False
+
+    return True
+
+
+def runAll(backends, suites, repeat, quick=True, romfs=None):
+    """
+    Runs the benchmarks once per backend,
+    returns {backend: benchmark report}
+    """
+    results = {}
+    for backend in backends:
+        if not setBackend(backend):
+            print("Skipping the %s backend, it isn't available" % backend)
+            continue
+
+        print("Benchmarking the %s backend..." % backend)
+        results[backend] = runBenchmarks(romfs, repeat=repeat, quick=quick, only=suites)
+
+    return results
+
+
+def mannWhitneyP(baseline, current):
+    """
+    One-sided p-value of the Mann-Whitney U test for the current
+    times being larger than the baseline ones (normal approximation
+    with tie and continuity correction)
+    """
+    n1 = len(baseline)
+    n2 = len(current)
+    n = n1 + n2
+
+    times = sorted([(t, 0) for t in baseline] + [(t, 1) for t in current])
+
+    # Rank sum of the current times, ties get their average rank
+    rankSum = 0
+    ties = 0
+    i = 0
+    while i < n:
+        j = i
+        while j + 1 < n and times[j + 1][0] == times[i][0]:
+            j += 1
+
+        rank = (i + j) / 2 + 1
+        rankSum += rank * sum(group for _, group in times[i:j + 1])
+
+        count = j - i + 1
+        ties += count ** 3 - count
+        i = j + 1
+
+    u = rankSum - n2 * (n2 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare(baseline, current, threshold=0.1, alpha=0.05):
+    """
+    Compares two {backend: report} results. Returns a row per
+    benchmark found in both, a regression being a median more than
+    threshold slower whose slowdown is significant at alpha.
+    """
+    rows = []
+    for backend, report in current.items():
+        if backend not in baseline:
+            continue
+
+        baseResults = {result['name']: result for result in baseline[backend]['results']}
+        for result in report['results']:
+            base = baseResults.get(result['name'])
+            if base is None:
+                continue
+
+            ratio = result['median'] / base['median'] if base['median'] else 1.0
+            p = mannWhitneyP(base['times'], result['times'])
+
+            rows.append({
+                'backend': backend,
+                'name': result['name'],
+                'baseline': base['median'],
+                'current': result['median'],
+                'ratio': ratio,
+                'p': p,
+                'regression': ratio > 1 + threshold and p < alpha,
+            })
+
+    return rows
+
+
+def printComparison(rows):
+    print()
+    print('%-8s %-36s %12s %12s %8s %8s' % ('backend', 'benchmark', 'base ms', 'now ms', 'ratio', 'p'))
+    for row in rows:
+        print('%-8s %-36s %12.3f %12.3f %8.2f %8.3f%s' % (
+            row['backend'], row['name'], row['baseline'] * 1000, row['current'] * 1000,
+            row['ratio'], row['p'], '  SLOWER' if row['regression'] else '',
+        ))
+
+
+def loadResults(filename):
+    with open(filename, encoding='utf-8') as inf:
+        return json.load(inf)
+
+
+def saveResults(results, filename):
+    with open(filename, 'w', encoding='utf-8') as out:
+        json.dump(results, out, indent=2, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fail if the benchmarks got significantly slower than the baseline.')
+    parser.add_argument('--baseline', default=BASELINE, help='the stored baseline (default: perf_baseline.json)')
+    parser.add_argument('--update-baseline', action='store_true', help='store this run as the new baseline')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two stored results, run nothing')
+    parser.add_argument('--results', metavar='FILE', help='also write the results of this run to FILE')
+    parser.add_argument('--backends', nargs='+', default=BACKENDS, choices=BACKENDS)
+    parser.add_argument('--suites', nargs='+', default=DEFAULT_SUITES)
+    parser.add_argument('--romfs', help='benchmark on this romfs instead of synthetic fixtures')
+    parser.add_argument('--repeat', type=int, default=7, help='timed runs per benchmark, at least 5 for a meaningful test')
+    parser.add_argument('--full', action='store_true', help='include the largest surfaces')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown tolerated, 0.1 being 10%%')
+    parser.add_argument('--alpha', type=float, default=0.05, help='significance level of the test')
+    args = parser.parse_args()
+
+    if args.compare:
+        rows = compare(loadResults(args.compare[0]), loadResults(args.compare[1]), args.threshold, args.alpha)
+
+    else:
+        if not args.update_baseline and not os.path.isfile(args.baseline):
+            print("No baseline at %s, create one with --update-baseline" % args.baseline)
+            sys.exit(2)
+
+        results = runAll(args.backends, args.suites, args.repeat, not args.full, args.romfs)
+
+        if args.results:
+            saveResults(results, args.results)
+
+        if args.update_baseline:
+            saveResults(results, args.baseline)
+            print("Stored the baseline in %s" % args.baseline)
+            return
+
+        rows = compare(loadResults(args.baseline), results, args.threshold, args.alpha)
+
+    printComparison(rows)
+
+    regressions = [row for row in rows if row['regression']]
+    if regressions:
+        print()
+        print("%d benchmarks got significantly slower!" % len(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
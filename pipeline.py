@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# pipeline.py
+# An asyncio conversion pipeline: levels and tilesets are read and
+# written in background threads while they're converted in worker
+# processes, so slow disks are hidden behind the conversion
+
+
+################################################################
+################################################################
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import os
+import struct
+
+from NSMBU import Game, GetLevelTilesetNames, GetTilesetSlots, checkContent, makeExecutor, makeLevelArchive
+from tileset import GetTilesetFilename, LoadTilesetData, SaveTileset
+
+
+def readFile(filename):
+    with open(filename, 'rb') as inf:
+        return inf.read()
+
+
+def writeArchive(filename, archive):
+    with open(filename, 'wb') as out:
+        archive.write(out)
+
+
+def describeError(e):
+    """
+    Returns the warning message for an error that failed a level or tileset
+    """
+    if isinstance(e, (OSError, RuntimeError, ValueError, struct.error)):
+        return str(e)
+
+    # Anything else is unexpected, so say what it was
+    return "%s: %s" % (type(e).__name__, e) if str(e) else type(e).__name__
+
+
+def convertTilesetData(name, anims, data):
+    """
+    Converts a tileset from the contents of its .szs file (runs in a worker)
+    """
+    return SaveTileset(name, LoadTilesetData(0 if anims else 1, name, data))
+
+
+def convertLevelData(name, data):
+    """
+    Converts the areas of a level from the contents of its file
+    (runs in a worker), returns its course archive. The tilesets
+    are added by the pipeline, so they're never sent to a worker.
+    """
+    level = Game.Level(name)
+    if not level.load(data, loadTilesets=False):
+        raise RuntimeError("%s has no course folder!" % name)
+
+    return level.saveCourse()
+
+
+class Pipeline:
+    """
+    Converts levels with the file I/O overlapped with the conversion.
+    Up to prefetch levels are in flight at once: their files and the
+    tilesets they use are read by ioThreads threads, the conversion runs
+    in a pool of workers processes and the level archives are written
+    by the threads again. Every tileset is converted once per run and
+    dropped after the last level using it, if the jobs say which
+    tilesets they use. A tileset that failed is converted again by the
+    next level using it. If onLevel is given, it's called with the job
+    and the result of every level as soon as the level is done.
+    """
+
+    def __init__(self, workers=None, ioThreads=4, prefetch=None, embedTilesets=True, onLevel=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.ioThreads = ioThreads
+        self.prefetch = prefetch or self.workers * 2
+        self.embedTilesets = embedTilesets
+        self.onLevel = onLevel
+
+    async def run(self, jobs):
+        """
+        Converts the levels, jobs being (name, filename, outName, slots)
+        tuples where slots is GetTilesetSlots() of the level or None.
+        Returns {name: None if it was converted, else the error message}.
+        """
+        self.loop = asyncio.get_running_loop()
+
+        # (name, anims): task converting the tileset
+        self.tilesets = {}
+        self.refs = {}
+        self.counted = all(job[3] is not None for job in jobs)
+        if self.counted:
+            for job in jobs:
+                for key in self.keys(job[3]):
+                    self.refs[key] = self.refs.get(key, 0) + 1
+
+        limit = asyncio.Semaphore(self.prefetch)
+
+        async def convert(job):
+            async with limit:
+                try:
+                    result = await self.convertLevel(*job[:3])
+
+                finally:
+                    self.release(job[3])
+
+                if self.onLevel is not None:
+                    self.onLevel(job, result)
+
+                return result
+
+        with ThreadPoolExecutor(self.ioThreads) as self.io, makeExecutor(self.workers) as self.cpu:
+            results = await asyncio.gather(*(convert(job) for job in jobs))
+
+        self.tilesets = {}
+        return {job[0]: result for job, result in zip(jobs, results)}
+
+    @staticmethod
+    def keys(slots):
+        return [(name, slot == 0) for name, slot in slots.items()]
+
+    async def convertTileset(self, key):
+        name, anims = key
+        filename = GetTilesetFilename(name)
+        if not os.path.isfile(filename):
+            raise RuntimeError("Tileset %s not found!" % name)
+
+        data = await self.loop.run_in_executor(self.io, readFile, filename)
+        return await self.loop.run_in_executor(self.cpu, convertTilesetData, name, anims, data)
+
+    async def getTilesets(self, slots):
+        """
+        Returns {name: saved tileset} for a level, starting the
+        conversion of all of its tilesets that aren't cached at once
+        """
+        keys = self.keys(slots)
+        for key in keys:
+            if key not in self.tilesets:
+                self.tilesets[key] = asyncio.ensure_future(self.convertTileset(key))
+
+        tasks = [self.tilesets[key] for key in keys]
+        archives = await asyncio.gather(*tasks, return_exceptions=True)
+
+        errors = []
+        for key, task, archive in zip(keys, tasks, archives):
+            if isinstance(archive, BaseException):
+                # Don't cache the failure for the other levels
+                if self.tilesets.get(key) is task:
+                    del self.tilesets[key]
+
+                errors.append(archive)
+
+        if errors:
+            raise errors[0]
+
+        return {key[0]: archive for key, archive in zip(keys, archives)}
+
+    def release(self, slots):
+        """
+        Drops the tilesets no other pending level uses
+        """
+        if not self.counted:
+            return
+
+        for key in self.keys(slots):
+            if key not in self.refs:
+                continue
+
+            self.refs[key] -= 1
+            if not self.refs[key]:
+                del self.refs[key]
+                self.tilesets.pop(key, None)
+
+    async def convertLevel(self, name, filename, outName):
+        print("Converting %s..." % name)
+
+        try:
+            data = await self.loop.run_in_executor(self.io, readFile, filename)
+            if not checkContent(data):
+                raise RuntimeError("%s is not a valid level!" % name)
+
+            slots = GetTilesetSlots(GetLevelTilesetNames(data))
+            tilesetArchives = await self.getTilesets(slots) if self.embedTilesets else {}
+
+            course = await self.loop.run_in_executor(self.cpu, convertLevelData, name, data)
+
+            # Only the course data comes back from the worker, the
+            # tilesets the pipeline already has are added here
+            archive = makeLevelArchive(name, course, [(tileset, tilesetArchives[tileset])
+                                                      for tileset in slots if tileset in tilesetArchives])
+            await self.loop.run_in_executor(self.io, writeArchive, outName, archive)
+
+        except Exception as e:
+            # Anything a worker raised only fails this level
+            error = describeError(e)
+
+        else:
+            return None
+
+        print("Warning!!! %s could not be converted: %s" % (name, error))
+        return error
+
+
+def convertLevels(jobs, workers=None, ioThreads=4, prefetch=None, embedTilesets=True, onLevel=None):
+    """
+    Runs a Pipeline over the jobs, see Pipeline.run()
+    """
+    pipeline = Pipeline(workers, ioThreads, prefetch, embedTilesets, onLevel)
+    return asyncio.run(pipeline.run(jobs))
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# sarc.py
+# A zero-copy SARC reader and a SARC writer that streams
+# its members straight into a file
+
+
+################################################################
+################################################################
+
+from bisect import bisect_left
+import io
+import struct
+
+
+def round_up(x, y):
+    return ((x - 1) | (y - 1)) + 1
+
+
+def filenameHash(filename, key=0x65):
+    """
+    Returns the hash that should be used by an SFAT node
+    """
+    result = 0
+    for char in filename:
+        result = (result * key + ord(char)) & 0xFFFFFFFF
+
+    return result
+
+
+def getDataAlignment(data):
+    """
+    Returns the alignment SarcLib would give this member
+    """
+    if isinstance(data, Writer):
+        return 0x2000
+
+    magic = bytes(data[:8])
+
+    if magic[:4] == b'SARC':  # Archive
+        return 0x2000
+
+    elif magic[:4] in [b'Yaz0', b'Yaz1']:  # Yaz0 compressed archive
+        return 0x80
+
+    elif magic[:4] == b'FFNT':  # Wii U/Switch Binary font
+        return 0x2000
+
+    elif magic[:4] == b'CFNT':  # 3DS Binary font
+        return 0x80
+
+    elif magic[:4] in [b'CSTM', b'FSTM', b'FSTP', b'CWAV', b'FWAV']:  # Audio data
+        return 0x20
+
+    elif magic in [b'BNTX\0\0\0\0', b'BNSH\0\0\0\0', b'FSHA    ']:  # Switch GPU data
+        return 0x1000
+
+    elif magic[:4] in [b'Gfx2', b'FRES', b'AAHS', b'BAHS'] or data[-0x28:-0x24] == b'FLIM':  # Wii U GPU data
+        return 0x2000
+
+    elif magic[:4] == b'CTPK':  # 3DS Texture package
+        return 0x10
+
+    elif magic[:4] == b'CGFX' or data[-0x28:-0x24] == b'CLIM':  # 3DS Layout image and Binary Resources
+        return 0x80
+
+    elif magic[:4] == b'AAMP':  # Environment settings
+        return 8
+
+    elif magic[:2] in [b'YB', b'BY'] or magic in [b'MsgStdBn', b'MsgPrjBn']:  # Binary text
+        return 0x80
+
+    elif bytes(data[0xC:0x10]) == b'SCDL':  # SMM2 Course data
+        return 0x100
+
+    else:
+        return 4
+
+
+class Reader:
+    """
+    Reads a SARC archive without copying it.
+    The SFAT and SFNT tables are parsed once, names are looked up by
+    their hash with a binary search and members are returned as
+    memoryview slices of the archive data.
+    """
+
+    def __init__(self, data):
+        data = memoryview(data)
+
+        if data[:4] != b'SARC':
+            raise ValueError('This is not a valid SARC file!')
+
+        bom = data[6:8]
+        if bom == b'\xFE\xFF':
+            self.endianness = '>'
+
+        elif bom == b'\xFF\xFE':
+            self.endianness = '<'
+
+        else:
+            raise ValueError('Invalid SARC byte order mark!')
+
+        headLen, _, fileSize, dataStart = struct.unpack_from(self.endianness + 'HHII', data, 4)
+        if headLen != 0x14 or data[0x14:0x18] != b'SFAT':
+            raise ValueError('Invalid SARC header!')
+
+        nodeCount, self.hashKey = struct.unpack_from(self.endianness + 'HI', data, 0x1A)
+
+        namesPos = 0x20 + 0x10 * nodeCount
+        if data[namesPos:namesPos + 4] != b'SFNT':
+            raise ValueError('Invalid SFNT header!')
+
+        namesPos += 8
+
+        # (hash, name offset or -1, data start, data end)
+        nodes = []
+        for hash, attrs, start, end in struct.iter_unpack(self.endianness + '4I', data[0x20:namesPos - 8]):
+            nameOffset = (attrs & 0xFFFFFF) * 4 if attrs >> 24 else -1
+            nodes.append((hash, nameOffset, dataStart + start, dataStart + end))
+
+        # The SFAT should already be sorted, but don't rely on it
+        nodes.sort(key=lambda node: node[0])
+
+        self.data = data
+        self.nameTable = bytes(data[namesPos:dataStart])
+        self.nodes = nodes
+        self.hashes = [node[0] for node in nodes]
+        self._names = None
+
+    def _nameAt(self, offset):
+        end = self.nameTable.find(b'\0', offset)
+        if end == -1:
+            return self.nameTable[offset:].decode('utf-8')
+
+        return self.nameTable[offset:end].decode('utf-8')
+
+    def _find(self, name):
+        """
+        Returns the node for the given name, or None
+        """
+        hash = filenameHash(name, self.hashKey)
+        i = bisect_left(self.hashes, hash)
+
+        while i < len(self.nodes) and self.hashes[i] == hash:
+            node = self.nodes[i]
+
+            # Make sure it isn't a collision
+            if node[1] == -1 or self._nameAt(node[1]) == name:
+                return node
+
+            i += 1
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def __getitem__(self, name):
+        node = self._find(name)
+        if node is None:
+            raise KeyError(name)
+
+        return self.data[node[2]:node[3]]
+
+    def get(self, name, default=None):
+        node = self._find(name)
+        if node is None:
+            return default
+
+        return self.data[node[2]:node[3]]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def names(self):
+        """
+        Returns the names of all members, in SFAT order
+        """
+        if self._names is None:
+            self._names = [self._nameAt(node[1]) if node[1] != -1 else 'hash_%08x' % node[0]
+                           for node in self.nodes]
+
+        return self._names
+
+    def items(self):
+        """
+        Returns (name, data) pairs for all members, in SFAT order
+        """
+        data = self.data
+        return [(name, data[node[2]:node[3]]) for name, node in zip(self.names(), self.nodes)]
+
+
+class Writer:
+    """
+    Builds a SARC archive without holding its contents in memory.
+    The file table is laid out first, then the member data
+    (which can be bytes-like objects or other Writers) is written
+    directly into the output stream.
+    The layout matches what SarcLib.SARC_Archive.save() produces.
+    """
+
+    def __init__(self, endianness='>', hashKey=0x65):
+        self.endianness = endianness
+        self.hashKey = hashKey
+        self.files = []
+        self._layout = None
+
+    def addFile(self, name, data):
+        """
+        Adds a member, name being its full path within the archive
+        """
+        self.files.append((name, data))
+        self._layout = None
+
+    def __contains__(self, name):
+        return any(name == fileName for fileName, _ in self.files)
+
+    def layout(self):
+        """
+        Returns the entries (hash, name offset, data offset, size, data),
+        the name table, the data start offset and the total archive size
+        """
+        if self._layout is not None:
+            return self._layout
+
+        files = sorted(self.files, key=lambda file: filenameHash(file[0], self.hashKey))
+
+        # Create the File Names table
+        names = bytearray()
+        entries = []
+        for name, data in files:
+            entries.append([filenameHash(name, self.hashKey), len(names), 0, len(data), data])
+
+            names += name.encode('utf-8')
+            names += b'\0' * (4 - len(names) % 4)
+
+        # Lay out the data, every member aligned the way the game expects it
+        dataSize = 0
+        maxAlignment = 4
+        for entry in entries:
+            alignment = getDataAlignment(entry[4])
+            maxAlignment = max(maxAlignment, alignment)
+
+            dataSize = round_up(dataSize, alignment)
+            entry[2] = dataSize
+            dataSize += entry[3]
+
+        dataStart = round_up(0x20 + 0x10 * len(entries) + 0x08 + len(names), maxAlignment)
+
+        self._layout = entries, bytes(names), dataStart, dataStart + dataSize
+        return self._layout
+
+    def __len__(self):
+        return self.layout()[3]
+
+    def write(self, f):
+        """
+        Writes the archive to the file object f
+        """
+        entries, names, dataStart, fileSize = self.layout()
+        endianness = self.endianness
+
+        # SARC and SFAT Headers
+        head = bytearray(0x20 + 0x10 * len(entries) + 0x08)
+        struct.pack_into(endianness + '4sHHIIHxx', head, 0, b'SARC', 0x14, 0xFEFF, fileSize, dataStart, 0x100)
+        struct.pack_into(endianness + '4sHHI', head, 0x14, b'SFAT', 0x0C, len(entries), self.hashKey)
+
+        # SFAT Nodes
+        node = struct.Struct(endianness + '4I')
+        pos = 0x20
+        for hash, nameOffset, dataOffset, size, _ in entries:
+            node.pack_into(head, pos, hash, (nameOffset // 4) | 0x1000000, dataOffset, dataOffset + size)
+            pos += 0x10
+
+        # SFNT Header
+        struct.pack_into(endianness + '4sHxx', head, pos, b'SFNT', 0x08)
+
+        f.write(head)
+        f.write(names)
+
+        # File Data
+        pos = len(head) + len(names)
+        for _, _, dataOffset, size, data in entries:
+            writeZeros(f, dataStart + dataOffset - pos)
+
+            if isinstance(data, Writer):
+                data.write(f)
+
+            else:
+                f.write(data)
+
+            pos = dataStart + dataOffset + size
+
+    def save(self):
+        """
+        Returns the archive as a bytes object
+        """
+        out = io.BytesIO()
+        self.write(out)
+        return out.getvalue()
+
+
+_zeros = memoryview(bytes(0x2000))
+
+
+def writeZeros(f, count):
+    """
+    Writes count null bytes to f
+    """
+    while count > 0:
+        f.write(_zeros[:count])
+        count -= len(_zeros)
@@ -29,13 +29,11 @@ def getBlockHeight(height):
     return blockHeight
 
 
-def _swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, blockHeightLog2, data, toSwizzle):
-    assert 0 <= blockHeightLog2 <= 5
-    blockHeight = 1 << blockHeightLog2
-
-    width = DIV_ROUND_UP(width, blkWidth)
-    height = DIV_ROUND_UP(height, blkHeight)
-
+def getSurfaceSize(width, height, roundPitch, bpp, tileMode, blockHeight):
+    """
+    Returns the pitch and size of a swizzled surface,
+    width and height being in blocks
+    """
     if tileMode == 1:
         pitch = width * bpp
 
@@ -48,7 +46,11 @@ def _swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, bloc
         pitch = round_up(width * bpp, 64)
         surfSize = pitch * round_up(height, blockHeight * 8)
 
-    result = bytearray(surfSize)
+    return pitch, surfSize
+
+
+def _swizzleInto(width, height, roundPitch, bpp, tileMode, blockHeight, data, result, toSwizzle):
+    pitch, surfSize = getSurfaceSize(width, height, roundPitch, bpp, tileMode, blockHeight)
 
     for y in range(height):
         for x in range(width):
@@ -67,6 +69,18 @@ def _swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, bloc
                 else:
                     result[pos_:pos_ + bpp] = data[pos:pos + bpp]
 
+
+def _swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, blockHeightLog2, data, toSwizzle):
+    assert 0 <= blockHeightLog2 <= 5
+    blockHeight = 1 << blockHeightLog2
+
+    width = DIV_ROUND_UP(width, blkWidth)
+    height = DIV_ROUND_UP(height, blkHeight)
+
+    _, surfSize = getSurfaceSize(width, height, roundPitch, bpp, tileMode, blockHeight)
+    result = bytearray(surfSize)
+
+    _swizzleInto(width, height, roundPitch, bpp, tileMode, blockHeight, data, result, toSwizzle)
     return result
 
 
@@ -78,6 +92,26 @@ def swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, block
     return _swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, blockHeightLog2, bytes(data), 1)
 
 
+def deswizzleInto(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, blockHeightLog2, data, out):
+    """
+    Deswizzles data into the writable buffer out, which must be large
+    enough for the unpadded image. Returns the size of the image.
+    """
+    assert 0 <= blockHeightLog2 <= 5
+    blockHeight = 1 << blockHeightLog2
+
+    width = DIV_ROUND_UP(width, blkWidth)
+    height = DIV_ROUND_UP(height, blkHeight)
+
+    size = width * height * bpp
+    out = memoryview(out).cast('B')
+    if len(out) < size:
+        raise ValueError("The output buffer is too small: %d < %d" % (len(out), size))
+
+    _swizzleInto(width, height, roundPitch, bpp, tileMode, blockHeight, memoryview(data).cast('B'), out, 0)
+    return size
+
+
 def getAddrBlockLinear(x, y, image_width, bytes_per_pixel, base_address, blockHeight):
     """
     From the Tegra X1 TRM
@@ -38,53 +38,68 @@ cpdef u32 getBlockHeight(u32 height):
     return blockHeight
 
 
-cdef bytearray _swizzle(u32 width, u32 height, u32 blkWidth, u32 blkHeight, int roundPitch, u32 bpp, u32 tileMode, int blockHeightLog2, bytearray data, int toSwizzle):
-    assert 0 <= blockHeightLog2 <= 5
-    cdef u32 blockHeight = 1 << blockHeightLog2
-
-    width = DIV_ROUND_UP(width, blkWidth)
-    height = DIV_ROUND_UP(height, blkHeight)
-
-    cdef:
-        u32 pitch
-        u32 surfSize
-
+cdef void getSurfaceSize(u32 width, u32 height, int roundPitch, u32 bpp, u32 tileMode, u32 blockHeight, u32 *pitch, u32 *surfSize):
     if tileMode == 1:
-        pitch = width * bpp
+        pitch[0] = width * bpp
 
         if roundPitch:
-            pitch = round_up(pitch, 32)
+            pitch[0] = round_up(pitch[0], 32)
 
-        surfSize = pitch * height
+        surfSize[0] = pitch[0] * height
 
     else:
-        pitch = round_up(width * bpp, 64)
-        surfSize = pitch * round_up(height, blockHeight * 8)
+        pitch[0] = round_up(width * bpp, 64)
+        surfSize[0] = pitch[0] * round_up(height, blockHeight * 8)
+
+
+cdef void _swizzleInto(u32 width, u32 height, int roundPitch, u32 bpp, u32 tileMode, u32 blockHeight,
+                       const u8 *data, u32 dataSize, u8 *result, int toSwizzle):
 
     cdef:
-        u8 *result = <u8 *>malloc(surfSize)
+        u32 pitch
+        u32 surfSize
         u32 x, y, pos, pos_, i
 
-    try:
-        for y in range(height):
-            for x in range(width):
-                if tileMode == 1:
-                    pos = y * pitch + x * bpp
+    getSurfaceSize(width, height, roundPitch, bpp, tileMode, blockHeight, &pitch, &surfSize)
+
+    for y in range(height):
+        for x in range(width):
+            if tileMode == 1:
+                pos = y * pitch + x * bpp
 
-                else:
-                    pos = getAddrBlockLinear(x, y, width, bpp, 0, blockHeight)
+            else:
+                pos = getAddrBlockLinear(x, y, width, bpp, 0, blockHeight)
 
-                pos_ = (y * width + x) * bpp
+            pos_ = (y * width + x) * bpp
 
-                if pos + bpp <= surfSize:
-                    if toSwizzle:
+            if pos + bpp <= surfSize:
+                if toSwizzle:
+                    if pos_ + bpp <= dataSize:
                         for i in range(bpp):
                             result[pos + i] = data[pos_ + i]
 
-                    else:
-                        for i in range(bpp):
-                            result[pos_ + i] = data[pos + i]
+                elif pos + bpp <= dataSize:
+                    for i in range(bpp):
+                        result[pos_ + i] = data[pos + i]
+
+
+cdef bytearray _swizzle(u32 width, u32 height, u32 blkWidth, u32 blkHeight, int roundPitch, u32 bpp, u32 tileMode, int blockHeightLog2, bytearray data, int toSwizzle):
+    assert 0 <= blockHeightLog2 <= 5
+    cdef u32 blockHeight = 1 << blockHeightLog2
 
+    width = DIV_ROUND_UP(width, blkWidth)
+    height = DIV_ROUND_UP(height, blkHeight)
+
+    cdef:
+        u32 pitch
+        u32 surfSize
+
+    getSurfaceSize(width, height, roundPitch, bpp, tileMode, blockHeight, &pitch, &surfSize)
+
+    cdef u8 *result = <u8 *>malloc(surfSize)
+
+    try:
+        _swizzleInto(width, height, roundPitch, bpp, tileMode, blockHeight, data, len(data), result, toSwizzle)
         return bytearray(<u8[:surfSize]>result)
 
     finally:
@@ -99,6 +114,27 @@ cpdef swizzle(u32 width, u32 height, u32 blkWidth, u32 blkHeight, int roundPitch
     return _swizzle(width, height, blkWidth, blkHeight, roundPitch, bpp, tileMode, blockHeightLog2, bytearray(data), 1)
 
 
+cpdef u32 deswizzleInto(u32 width, u32 height, u32 blkWidth, u32 blkHeight, int roundPitch, u32 bpp, u32 tileMode, int blockHeightLog2, const u8[:] data, u8[:] out):
+    """
+    Deswizzles data into the writable buffer out, which must be large
+    enough for the unpadded image. Returns the size of the image.
+    """
+    assert 0 <= blockHeightLog2 <= 5
+    cdef u32 blockHeight = 1 << blockHeightLog2
+
+    width = DIV_ROUND_UP(width, blkWidth)
+    height = DIV_ROUND_UP(height, blkHeight)
+
+    cdef u32 size = width * height * bpp
+    if <u32>out.shape[0] < size:
+        raise ValueError("The output buffer is too small: %d < %d" % (out.shape[0], size))
+
+    if size and data.shape[0]:
+        _swizzleInto(width, height, roundPitch, bpp, tileMode, blockHeight, &data[0], data.shape[0], &out[0], 0)
+
+    return size
+
+
 cdef u32 getAddrBlockLinear(u32 x, u32 y, u32 image_width, u32 bytes_per_pixel, u32 base_address, u32 blockHeight):
     """
     From the Tegra X1 TRM
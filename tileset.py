@@ -4,22 +4,52 @@
 import os
 import struct
 
+import bcn
 import bntx as BNTX
 import gtx
-import SarcLib
+import instrument
+import sarc
 
-from yaz0 import determineCompressionMethod
-_, DecompYaz0 = determineCompressionMethod()
+from yaz0 import determineCompressionMethod, libyaz0_available
+CompYaz0, DecompYaz0 = determineCompressionMethod()
 
 
 TilesetPath = ''
 
+# Block compressed BNTX formats, passed through to the GX2 format
+# they're the same as: BNTX format -> GX2 format
+BCnFormats = {
+    0x1a01: 0x31, 0x1a06: 0x431,  # BC1
+    0x1b01: 0x32, 0x1b06: 0x432,  # BC2
+    0x1c01: 0x33, 0x1c06: 0x433,  # BC3
+    0x1d01: 0x34, 0x1d02: 0x234,  # BC4
+    0x1e01: 0x35, 0x1e02: 0x235,  # BC5
+}
+
+# How the textures of the converted tilesets are written, see SetTextureOptions()
+TextureOptions = {
+    # Number of mip levels generated, 1 for none
+    'mips': 1,
+
+    # None to keep RGBA8, "bc1", "bc3" or "bc" for BC1 if opaque and BC3 otherwise
+    'compression': None,
+
+    # Number of processes encoding the textures, only used by the main
+    # process: the workers of makeExecutor() encode theirs themselves
+    'encodeWorkers': 1,
+}
+
 
 class Tileset:
     def __init__(self):
         self.defs = None
         self.colldata = b''
 
+        # The original BG_unt files, saved back as they are instead of
+        # serializing defs again. Set them to None after modifying defs.
+        self.deffile = None
+        self.indexfile = None
+
         self.img = None
         self.nml = None
         self.hatena_anime = None
@@ -52,25 +82,26 @@ class ObjectDef:
 
     def load(self, source, offset):
         """
-        Load an object definition
+        Load an object definition starting at offset in source,
+        which can be a memoryview, it's never copied
         """
-        source = source[offset:]
+        end = len(source)
 
-        if source[0] & 0x80 and source[0] & 2:
+        if source[offset] & 0x80 and source[offset] & 2:
             self.reversed = True
 
-        i = 0
+        i = offset
+        rows = self.rows
         row = []
-        cbyte = source[i]
 
-        while i < len(source):
+        while i < end:
             cbyte = source[i]
 
             if cbyte == 0xFF:
                 break
 
             elif cbyte == 0xFE:
-                self.rows.append(row)
+                rows.append(row)
                 i += 1
                 row = []
 
@@ -79,21 +110,102 @@ class ObjectDef:
                     self.mainPartAt = 0
 
                 else:
-                    self.subPartAt = len(self.rows)
+                    self.subPartAt = len(rows)
 
                 row.append((cbyte,))
                 i += 1
 
-            else:
-                if i + 3 > len(source):
-                    source += b'\0' * (i + 3 - len(source)) + b'\xfe\xff'
+            elif i + 3 > end:
+                # Truncated tile, the missing bytes are zero
+                # and the definition ends right after it
+                extra = source[i + 2] if i + 2 < end else 0
+                tilenum = source[i + 1] if i + 1 < end else 0
+                row.append((cbyte, tilenum | ((extra & 3) << 8), extra >> 2))
+                rows.append(row)
+                break
 
+            else:
                 extra = source[i + 2]
-                tile = [cbyte, source[i + 1] | ((extra & 3) << 8), extra >> 2]
-                row.append(tile)
+                row.append((cbyte, source[i + 1] | ((extra & 3) << 8), extra >> 2))
                 i += 3
 
 
+def LoadObjectDefs(indexfile, deffile):
+    """
+    Loads all object definitions of a tileset from its BG_unt index
+    (_hd.bin) and definitions file in a single pass over both
+    """
+    defs = [None] * 256
+    deffile = memoryview(deffile)
+    indexsize = len(indexfile) // 6 * 6
+
+    for i, (offset, width, height, randByte) in enumerate(struct.iter_unpack('<HBBH', indexfile[:indexsize])):
+        obj = ObjectDef()
+        obj.width = width
+        obj.height = height
+        obj.randByte = randByte
+        obj.load(deffile, offset)
+        defs[i] = obj
+
+    return defs
+
+
+def SaveObjectDefs(defs):
+    """
+    Serializes object definitions, returns the BG_unt
+    definitions file and its big endian index (_hd.bin)
+    """
+    count = 0
+    size = 0
+    for obj in defs:
+        if obj is None:
+            break
+
+        count += 1
+        size += 1 + sum(len(tile) for row in obj.rows for tile in row) + len(obj.rows)
+
+    deffile = bytearray(size)
+    indexfile = bytearray(count * 6)
+    indexstruct = struct.Struct('>HBBxB')
+
+    pos = 0
+    for i in range(count):
+        obj = defs[i]
+        indexstruct.pack_into(indexfile, i * 6, pos, obj.width, obj.height, obj.randByte)
+
+        for row in obj.rows:
+            for tile in row:
+                if len(tile) == 3:
+                    deffile[pos] = tile[0]
+                    deffile[pos + 1] = tile[1] & 0xFF
+                    deffile[pos + 2] = (tile[2] << 2) | ((tile[1] >> 8) & 3)  # Slot
+                    pos += 3
+
+                else:
+                    deffile[pos:pos + len(tile)] = bytes(tile)
+                    pos += len(tile)
+
+            deffile[pos] = 0xFE
+            pos += 1
+
+        deffile[pos] = 0xFF
+        pos += 1
+
+    return deffile, indexfile
+
+
+def SwapObjectIndex(indexfile):
+    """
+    Converts a little endian BG_unt index (_hd.bin) to big endian
+    by swapping the bytes of the offset and randByte fields
+    """
+    index = bytearray(indexfile[:len(indexfile) // 6 * 6])
+    index[0::6], index[1::6] = index[1::6], index[0::6]
+    index[4::6], index[5::6] = index[5::6], index[4::6]
+
+    return index
+
+
 def loadBNTXFromBFRES(inb):
     assert inb[:8] == b'FRES    '
     bom = ">" if inb[0xC:0xE] == b'\xFE\xFF' else "<"
@@ -115,7 +227,7 @@ def loadBNTXFromBFRES(inb):
             data = inb[fileoff:fileoff + dataSize]
             nameoff = struct.unpack(bom + "q", inb[namesoff + i * 16:namesoff + 8 + i * 16])[0]
             nameSize = struct.unpack(bom + 'H', inb[nameoff:nameoff + 2])[0]
-            name = inb[nameoff + 2:nameoff + 2 + nameSize].decode('utf-8')
+            name = str(inb[nameoff + 2:nameoff + 2 + nameSize], 'utf-8')
 
             if name == "textures.bntx":
                 bntx = BNTX.File(); bntx.load(data, 0)
@@ -135,66 +247,111 @@ def loadTexFromBNTX(bntx, name):
     else:
         raise RuntimeError("Tileset not found")
 
-    # Assume RGBA8
-    # I won't bother adding other formats cuz
-    # RGBA8 is what OG NSMBUDX uses
+    # RGBA8 is what OG NSMBUDX uses, mods can have block compressed
+    # textures which are kept compressed, with their mip levels.
+    # Returns the texture, its size, compSel, GX2 format and mip levels.
+    # Only the mip levels that end up in the GTX are deswizzled
     if texture.format_ in [0xb01, 0xb06] and texture.dim == 2:
-        result, _, _ = bntx.rawData(texture)
-        return [result[0], texture.width, texture.height, texture.compSel]
+        with instrument.stage('deswizzle', texture.imageSize):
+            result, _, _ = bntx.rawData(texture, [0])
+
+        return [result[0], texture.width, texture.height, texture.compSel, 0x1a, []]
+
+    if texture.format_ in BCnFormats and texture.dim == 2:
+        with instrument.stage('deswizzle', texture.imageSize):
+            result, _, _ = bntx.rawData(texture, range(min(texture.numMips, TextureOptions['mips'])))
+
+        return [result[0], texture.width, texture.height, texture.compSel, BCnFormats[texture.format_], result[1:]]
 
     raise RuntimeError("%s could not be loaded" % name)
 
 
-def LoadTileset(idx, name):
+def GetTilesetPath():
     """
-    Load in a tileset into a specific slot
+    Returns the path to the "Unit" folder, asking for it the first time
     """
-
-    if not name:
-        return None
-
     global TilesetPath
     if not TilesetPath:
         TilesetPath = input('Enter the path to the "Unit" folder, e.g. "C:\\NSMBUDX\\romfs\\Unit": ')
 
-    path = TilesetPath
-    found = False
+    return TilesetPath
+
 
-    if path:
-        sarcname = os.path.join(os.path.dirname(path), 'Unit', name + '.szs')
-        if os.path.isfile(sarcname):
-            found = True
+def SetTilesetPath(path):
+    """
+    Sets the path to the "Unit" folder
+    """
+    global TilesetPath
+    TilesetPath = path
+
+
+def GetTextureOptions():
+    """
+    Returns a copy of the texture options
+    """
+    return dict(TextureOptions)
 
-    if not found:
+
+def SetTextureOptions(**options):
+    """
+    Sets how the textures of the converted tilesets are written
+    """
+    for name, value in options.items():
+        if name not in TextureOptions:
+            raise ValueError("Unknown texture option: %s" % name)
+
+        TextureOptions[name] = value
+
+
+def GetTilesetFilename(name):
+    """
+    Returns the path to the .szs file of a tileset
+    """
+    path = GetTilesetPath()
+    if not path:
+        return ''
+
+    return os.path.join(os.path.dirname(path), 'Unit', name + '.szs')
+
+
+def LoadTileset(idx, name):
+    """
+    Load in a tileset into a specific slot
+    """
+
+    if not name:
+        return None
+
+    sarcname = GetTilesetFilename(name)
+    if not os.path.isfile(sarcname):
         raise RuntimeError("Tileset %s not found!" % name)
 
     # get the data
     with open(sarcname, 'rb') as fileobj:
         sarcdata = fileobj.read()
 
-    if sarcdata[:4] != b'Yaz0':
-        raise RuntimeError("Tileset is not Yaz0 compressed!")
-
-    sarcdata = DecompYaz0(sarcdata)
+    return LoadTilesetData(idx, name, sarcdata)
 
-    sarc = SarcLib.SARC_Archive()
-    sarc.load(sarcdata)
 
-    def exists(fn):
-        nonlocal sarc
+@instrument.timed('tileset.load')
+def LoadTilesetData(idx, name, sarcdata):
+    """
+    Load in a tileset into a specific slot from the contents of its .szs file
+    """
 
-        try:
-            sarc[fn]
+    if sarcdata[:4] != b'Yaz0':
+        raise RuntimeError("Tileset is not Yaz0 compressed!")
 
-        except KeyError:
-            return False
+    with instrument.stage('yaz0', len(sarcdata)):
+        sarcdata = DecompYaz0(sarcdata)
 
-        return True
+    with instrument.stage('sarc', len(sarcdata)):
+        arc = sarc.Reader(sarcdata)
 
     # Decompress the textures
     try:
-        bfresdata = sarc['output.bfres'].data
-        colldata = sarc['BG_chk/d_bgchk_%s.bin' % name].data
+        bfresdata = arc['output.bfres']
+        colldata = bytes(arc['BG_chk/d_bgchk_%s.bin' % name])
 
     except KeyError:
         raise RuntimeError("Looks like tileset is corrupted...")
@@ -202,7 +359,9 @@ def LoadTileset(idx, name):
     tileset = Tileset()
 
     # load in the textures
-    bntx = loadBNTXFromBFRES(bfresdata)
+    with instrument.stage('bntx', len(bfresdata)):
+        bntx = loadBNTXFromBFRES(bfresdata)
+
     tileset.img = loadTexFromBNTX(bntx, name)
     tileset.nml = loadTexFromBNTX(bntx, name + "_nml")
     
@@ -247,39 +406,48 @@ def LoadTileset(idx, name):
             pass
 
     # Load the object definitions
-    defs = [None] * 256
+    indexfile = arc['BG_unt/%s_hd.bin' % name]
+    deffile = arc['BG_unt/%s.bin' % name]
 
-    indexfile = sarc['BG_unt/%s_hd.bin' % name].data
-    deffile = sarc['BG_unt/%s.bin' % name].data
-    objcount = len(indexfile) // 6
-    indexstruct = struct.Struct('<HBBH')
+    with instrument.stage('objdefs.load', len(deffile)):
+        tileset.defs = LoadObjectDefs(indexfile, deffile)
 
-    for i in range(objcount):
-        data = indexstruct.unpack_from(indexfile, i * 6)
-        obj = ObjectDef()
-        obj.width = data[1]
-        obj.height = data[2]
-        obj.randByte = data[3]
-        obj.load(deffile, data[0])
-        defs[i] = obj
-
-    tileset.defs = defs
+    tileset.deffile = bytes(deffile)
+    tileset.indexfile = bytes(indexfile)
     tileset.colldata = colldata
 
     return tileset
 
 
-def writeGTX(data, width, height, compSel):
+def writeGTX(data, width, height, compSel, format_=0x1a, mips=()):
     """
-    Generates a GTX file
+    Generates a GTX file, from RGBA8 data or from block compressed
+    data in the GX2 format_ with its mip levels
     """
     toGX2CompSel = [4, 5, 0, 1, 2, 3]
     GX2CompSel = [toGX2CompSel[comp] for comp in compSel]
 
-    gtxdata = gtx.fromData(data, width, height, GX2CompSel)
+    size = len(data)
+    if format_ == 0x1a:
+        numMips = TextureOptions['mips']
+        encoded = False
+        if TextureOptions['compression']:
+            format_ = bcn.getFormat(data, TextureOptions['compression'])
+
+    else:
+        # Already compressed, only the mip levels it has can be kept
+        data = [data, *mips][:TextureOptions['mips']]
+        numMips = len(data)
+        encoded = True
+
+    with instrument.stage('swizzle', size):
+        gtxdata = gtx.fromData(data, width, height, GX2CompSel, numMips, format_,
+                               TextureOptions['encodeWorkers'], encoded)
+
     return gtxdata
 
 
+@instrument.timed('tileset.save')
 def SaveTileset(name, tilesetObj):
     """
     Saves a tileset from a specific slot
@@ -289,62 +457,62 @@ def SaveTileset(name, tilesetObj):
         return False
 
     colldata = tilesetObj.colldata
-    deffile = b''
-    indexfile = b''
-
-    for obj in defs:
-        if obj is None:
-            break
-
-        indexfile += struct.pack('>HBBxB', len(deffile), obj.width, obj.height, obj.randByte)
-
-        for row in obj.rows:
-            for tile in row:
-                if len(tile) == 3:
-                    byte2 = tile[2] << 2
-                    byte2 |= (tile[1] >> 8) & 3  # Slot
 
-                    deffile += bytes([tile[0], tile[1] & 0xFF, byte2])
-
-                else:
-                    deffile += bytes(tile)
+    with instrument.stage('objdefs.save'):
+        if tilesetObj.deffile is not None and tilesetObj.indexfile is not None:
+            # The objects are untouched, the definitions are endian-independent
+            deffile = tilesetObj.deffile
+            indexfile = SwapObjectIndex(tilesetObj.indexfile)
 
-            deffile += b'\xFE'
-
-        deffile += b'\xFF'
-
-    arc = SarcLib.SARC_Archive()
+        else:
+            deffile, indexfile = SaveObjectDefs(defs)
 
-    tex = SarcLib.Folder('BG_tex')
-    arc.addFolder(tex)
-    tex.addFile(SarcLib.File('%s.gtx' % name, writeGTX(*tilesetObj.img)))
-    tex.addFile(SarcLib.File('%s_nml.gtx' % name, writeGTX(*tilesetObj.nml)))
+    arc = sarc.Writer()
+    arc.addFile('BG_tex/%s.gtx' % name, writeGTX(*tilesetObj.img))
+    arc.addFile('BG_tex/%s_nml.gtx' % name, writeGTX(*tilesetObj.nml))
 
     if tilesetObj.hatena_anime:
-        tex.addFile(SarcLib.File('hatena_anime.gtx', writeGTX(*tilesetObj.hatena_anime)))
+        arc.addFile('BG_tex/hatena_anime.gtx', writeGTX(*tilesetObj.hatena_anime))
 
     if tilesetObj.block_anime:
-        tex.addFile(SarcLib.File('block_anime.gtx', writeGTX(*tilesetObj.block_anime)))
+        arc.addFile('BG_tex/block_anime.gtx', writeGTX(*tilesetObj.block_anime))
 
     if tilesetObj.hatena_anime_L:
-        tex.addFile(SarcLib.File('hatena_anime_L.gtx', writeGTX(*tilesetObj.hatena_anime_L)))
+        arc.addFile('BG_tex/hatena_anime_L.gtx', writeGTX(*tilesetObj.hatena_anime_L))
 
     if tilesetObj.block_anime_L:
-        tex.addFile(SarcLib.File('block_anime_L.gtx', writeGTX(*tilesetObj.block_anime_L)))
+        arc.addFile('BG_tex/block_anime_L.gtx', writeGTX(*tilesetObj.block_anime_L))
 
     if tilesetObj.tuka_coin_anime:
-        tex.addFile(SarcLib.File('tuka_coin_anime.gtx', writeGTX(*tilesetObj.tuka_coin_anime)))
+        arc.addFile('BG_tex/tuka_coin_anime.gtx', writeGTX(*tilesetObj.tuka_coin_anime))
 
     if tilesetObj.belt_conveyor_anime:
-        tex.addFile(SarcLib.File('belt_conveyor_anime.gtx', writeGTX(*tilesetObj.belt_conveyor_anime)))
+        arc.addFile('BG_tex/belt_conveyor_anime.gtx', writeGTX(*tilesetObj.belt_conveyor_anime))
 
-    chk = SarcLib.Folder('BG_chk')
-    arc.addFolder(chk)
-    chk.addFile(SarcLib.File('d_bgchk_%s.bin' % name, colldata))
+    arc.addFile('BG_chk/d_bgchk_%s.bin' % name, colldata)
 
-    unt = SarcLib.Folder('BG_unt')
-    arc.addFolder(unt)
-    unt.addFile(SarcLib.File('%s.bin' % name, deffile))
-    unt.addFile(SarcLib.File('%s_hd.bin' % name, indexfile))
+    arc.addFile('BG_unt/%s.bin' % name, deffile)
+    arc.addFile('BG_unt/%s_hd.bin' % name, indexfile)
+
+    return arc.save()
+
+
+def WriteTilesetArchive(name, data, outDir):
+    """
+    Writes a saved tileset to outDir, Yaz0 compressed as <name>.szs,
+    like the game's own Unit folder.
+    Without libyaz0 it's written uncompressed as <name>.sarc instead,
+    to be compressed with wszst or similar afterwards.
+    Returns the name of the written file.
+    """
+    if libyaz0_available:
+        filename = os.path.join(outDir, name + '.szs')
+        if not CompYaz0(data, filename):
+            raise RuntimeError("Tileset %s could not be compressed!" % name)
+
+    else:
+        filename = os.path.join(outDir, name + '.sarc')
+        with open(filename, 'wb') as out:
+            out.write(data)
 
-    return arc.save()[0]
+    return filename